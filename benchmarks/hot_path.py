@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+
+
+## Micro-benchmarks of protocol hot path of the BI-PSI server with regression gate.
+#
+# Measures cost per call of message handling functions, and of whole sessions served by ServerThread over fake connection
+# (no sockets) with realistic message mixes: one chunk per message, pipelined frames in big chunks and 1-byte fragments.
+# Sessions include 98-byte pickup (secret) messages.
+#
+# Every cost is also divided by cost of fixed calibration workload measured alternately with it, baseline stores these normalized costs so it can be compared
+# across machines. With --baseline, exits with status 1 when median of normalized costs of any benchmark is slower than baseline by more than tolerance.
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import server
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+## Connection replaying prepared chunks into ServerThread, instead of socket
+#
+class FakeConnection():
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param chunks Chunks of bytes returned by successive receives, then connection is closed by client
+    #
+    def __init__(self, chunks) -> None:
+        self.chunks = chunks
+        self.index = 0
+        self.offset = 0
+        self.sent = []
+
+    def settimeout(self, timeout):
+        pass
+
+    ## Receive next chunk (or its part fitting into buffer)
+    #
+    #  @param self
+    #  @param buffer Writable buffer
+    #  @param size Maximum number of bytes
+    #
+    #  @returns int Number of received bytes, 0 when all chunks were received
+    #
+    def recv_into(self, buffer, size=0):
+        if self.index == len(self.chunks):
+            return 0
+        chunk = self.chunks[self.index]
+        count = min(len(chunk) - self.offset, size or len(buffer), len(buffer))
+        buffer[:count] = chunk[self.offset:self.offset + count]
+        self.offset += count
+        if self.offset == len(chunk):
+            self.index += 1
+            self.offset = 0
+        return count
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+    def sendmsg(self, buffers):
+        self.sent += buffers
+        return sum(map(len, buffers))
+
+    def close(self):
+        pass
+
+
+## Record messages of robot driven by server from start position to zero coords
+#
+#  Robot is simulated against protocol core, so the script is valid for the server as it is (also with changed planner).
+#
+#  @param start Start coordinates
+#  @param direction Start direction (index into Movement.STEPS)
+#  @param obstacles Coordinates of obstacles
+#  @param secret Secret message picked up at zero coords
+#
+#  @returns tuple List of messages sent by robot and bytes of all replies
+#
+def robot_script(start, direction, obstacles, secret):
+    name = "Robot"
+    name_hash = (sum(name.encode()) * 1000) % 65536
+    messages = [name, "1", str((name_hash + server.CLIENT_KEY[1]) % 65536)]
+    session = server.Session(("127.0.0.1", 1))
+    replies = bytearray()
+    commands = []
+    for message in messages:
+        frames = session.receive((message + "\a\b").encode())
+        replies += b"".join(frames)
+        commands += [bytes(frame[:-2]).decode() for frame in frames]
+
+    (x, y) = start
+    steps = server.Session.Movement.STEPS
+    while commands:
+        command = commands.pop(0)
+        if command == "102 MOVE" and (x + steps[direction][0], y + steps[direction][1]) not in obstacles:
+            (x, y) = (x + steps[direction][0], y + steps[direction][1])
+        elif command == "103 TURN LEFT":
+            direction = (direction + 1) % 4
+        elif command == "104 TURN RIGHT":
+            direction = (direction - 1) % 4
+        elif command == "105 GET MESSAGE":
+            messages.append(secret)
+        elif command != "102 MOVE":
+            continue
+        if command != "105 GET MESSAGE":
+            messages.append("OK " + str(x) + " " + str(y))
+        frames = session.receive((messages[-1] + "\a\b").encode())
+        replies += b"".join(frames)
+        commands += [bytes(frame[:-2]).decode() for frame in frames]
+    return (messages, bytes(replies))
+
+## Find number of calls of function taking at least target time
+#
+#  @param function Function without arguments
+#  @param target Minimal duration in seconds
+#
+#  @returns int Number of calls
+#
+def calibrate(function, target) -> int:
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= target:
+            return loops
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(target / elapsed) + 1))
+
+## Measure duration of calls of function
+#
+#  @param function Function without arguments
+#  @param loops Number of calls
+#
+#  @returns float Nanoseconds per call
+#
+def measure(function, loops) -> float:
+    started = time.perf_counter()
+    for _ in range(loops):
+        function()
+    return (time.perf_counter() - started) / loops * 1e9
+
+## Measure cost of one call of function and of calibration workload
+#
+#  Measurements of both alternate, so both are affected by the same load of machine. Medians of repeated measurements are used,
+#  so single measurement disturbed by other processes does not decide.
+#
+#  @param function Function without arguments
+#  @param repeat Number of measurements
+#  @param target Minimal duration of one measurement in seconds
+#
+#  @returns tuple Nanoseconds per call of function and of calibration workload, and median of their ratios
+#
+def measure_calibrated(function, repeat, target) -> tuple:
+    loops = calibrate(function, target)
+    calibration_loops = calibrate(calibration, target)
+    costs = []
+    calibration_costs = []
+    for _ in range(repeat):
+        calibration_costs.append(measure(calibration, calibration_loops))
+        costs.append(measure(function, loops))
+    ratios = [cost / calibration_cost for (cost, calibration_cost) in zip(costs, calibration_costs)]
+    return (statistics.median(costs), statistics.median(calibration_costs), statistics.median(ratios))
+
+## Fixed pure Python workload used to normalize costs across machines
+#
+def calibration():
+    values = {}
+    for index in range(200):
+        values[index & 15] = values.get(index & 15, 0) + index
+    return "".join(str(value) for value in values.values()).split("1")
+
+## Prepare benchmarks
+#
+#  @returns dict Functions without arguments by benchmark name, with number of calls they make (for per call cost)
+#
+def benchmarks() -> dict:
+    secret = "Secret message picked up by robot " + "x" * 64
+    (script, replies) = robot_script((3, -4), 1, {(1, -4), (0, -2)}, secret)
+    frames = [(message + "\a\b").encode() for message in script]
+    pipelined = b"".join(frames)
+
+    mixes = {
+        "messages": frames,
+        "pipelined": [pipelined[offset:offset + 1024] for offset in range(0, len(pipelined), 1024)],
+        "fragments": [pipelined[offset:offset + 1] for offset in range(len(pipelined))]
+    }
+    cases = {}
+    for (mix, chunks) in mixes.items():
+        def serve(chunks=chunks):
+            connection = FakeConnection(chunks)
+            server.SLOTS.acquire()
+            session = server.ServerThread(connection, ("127.0.0.1", 1))
+            session.run()
+            return connection
+        # Server needs to reply the same way as to simulated robot
+        assert b"".join(serve().sent) == replies, mix
+        cases["handle_data." + mix] = (serve, len(frames))
+
+    authentication_messages = script[:3]
+    lengths = [frame[:-2] for frame in frames[:3]] + [b"RECHARG", b"Robot\a", b"x" * 19]
+    def authenticate():
+        authentication = server.Session.Authentication([])
+        for message in authentication_messages:
+            authentication.authenticate(message)
+    def authentication_verify_length():
+        authentication = server.Session.Authentication([])
+        for data in lengths:
+            authentication.verify_length(data)
+    cases["authentication.authenticate"] = (authenticate, len(authentication_messages))
+    cases["authentication.verify_length"] = (authentication_verify_length, len(lengths))
+
+    movement_messages = script[3:]
+    def process_message():
+        movement = server.Session.Movement([])
+        for message in movement_messages:
+            movement.process_message(message)
+    movement = server.Session.Movement([])
+    movement_lengths = [frame[:-2] for frame in frames[3:-1]] + [b"OK 1 2\a", b"OK 123456789"]
+    def movement_verify_length():
+        for data in movement_lengths:
+            movement.verify_length(data)
+    pickup = server.Session.Movement([])
+    pickup.picking_up_message = True
+    pickup_lengths = [secret.encode(), secret.encode() + b"\a", b"x" * 99]
+    def movement_verify_length_pickup():
+        for data in pickup_lengths:
+            pickup.verify_length(data)
+    digits = ["12", "-7", "0", "-", "1a", "-123456"]
+    def verify_digit():
+        for digit in digits:
+            movement.verify_digit(digit)
+    cases["movement.process_message"] = (process_message, len(movement_messages))
+    cases["movement.verify_length"] = (movement_verify_length, len(movement_lengths))
+    cases["movement.verify_length.pickup"] = (movement_verify_length_pickup, len(pickup_lengths))
+    cases["movement.verify_digit"] = (verify_digit, len(digits))
+    return cases
+
+## Run all (or selected) benchmarks
+#
+#  @param settings Parsed command line arguments
+#
+#  @returns dict Results
+#
+def run(settings) -> dict:
+    server.LOGGER.configure(None, 0.0)
+    calibration_costs = []
+    results = {}
+    for (name, (function, calls)) in benchmarks().items():
+        if settings.only and not any(part in name for part in settings.only):
+            continue
+        (cost, calibration_cost, ratio) = measure_calibrated(function, settings.repeat, settings.target)
+        calibration_costs.append(calibration_cost)
+        results[name] = {"ns_per_call": round(cost / calls, 1), "normalized": round(ratio / calls, 5)}
+    return {"calibration_ns": round(statistics.median(calibration_costs), 1) if calibration_costs else None, "results": results}
+
+## Compare results with baseline
+#
+#  @param results Results of run
+#  @param baseline Stored results
+#  @param tolerance Allowed relative slowdown
+#
+#  @returns list Names of benchmarks slower than baseline
+#
+def regressions(results, baseline, tolerance) -> list:
+    slower = []
+    for (name, result) in results["results"].items():
+        stored = baseline["results"].get(name)
+        if stored is None:
+            continue
+        result["baseline_ratio"] = round(result["normalized"] / stored["normalized"], 3)
+        if result["baseline_ratio"] > 1 + tolerance:
+            slower.append(name)
+    return slower
+
+## Parse command line arguments
+#
+#  @returns argparse.Namespace Settings
+#
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of BI-PSI server protocol hot path.")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measurements of every benchmark, their median is used (default: 5)")
+    parser.add_argument("--target", type=float, default=0.1, help="minimal duration of one measurement in seconds (default: 0.1)")
+    parser.add_argument("--only", nargs="+", help="run only benchmarks whose name contains any of given strings")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_PATH, metavar="PATH",
+                        help="fail when slower than baseline (default path: benchmarks/baseline.json)")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown against baseline (default: 0.3)")
+    parser.add_argument("--update-baseline", nargs="?", const=BASELINE_PATH, metavar="PATH", help="store results as new baseline")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args()
+
+def main():
+    settings = parse_arguments()
+    results = run(settings)
+
+    slower = []
+    if settings.baseline:
+        with open(settings.baseline) as file:
+            slower = regressions(results, json.load(file), settings.tolerance)
+        results["regressions"] = slower
+
+    if settings.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("calibration".ljust(34) + str(results["calibration_ns"]).rjust(12) + " ns")
+        for (name, result) in results["results"].items():
+            ratio = result.get("baseline_ratio")
+            print(name.ljust(34) + str(result["ns_per_call"]).rjust(12) + " ns/call"
+                  + ("  x" + str(ratio) + " of baseline" + (" REGRESSION" if name in slower else "") if ratio else ""))
+
+    if settings.update_baseline:
+        with open(settings.update_baseline, "w") as file:
+            json.dump({"calibration_ns": results["calibration_ns"], "results": results["results"]}, file, indent=2)
+            file.write("\n")
+
+    if slower:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+
+
+## Latency benchmark of socket tuning options of the BI-PSI server.
+#
+# Starts server with every configuration of socket options and drives robots through whole sessions, one at a time, so only round trip time is measured.
+# Reports round trip time of every step (login messages, moves, turns, pickup) from sending robot's message to receiving the reply.
+#
+# Every configuration is measured with robots sending each message in one write and with robots sending it in two writes
+# (Nagle's algorithm on, as naive robots do), where the second write waits for acknowledgement of the first one.
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from server import SERVER_KEY, CLIENT_KEY, MESSAGES
+
+DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
+## Robot fails after this many commands
+#
+MOVE_LIMIT = 200
+
+## Server arguments of compared configurations
+#
+CONFIGURATIONS = {
+    "nagle": ["--no-nodelay"],
+    "nodelay": [],
+    "quickack": ["--quickack"],
+    "keepalive": ["--keepalive"],
+    "buffers-4k": ["--rcvbuf", "4096", "--sndbuf", "4096"],
+    "recv-size-64": ["--recv-size", "64"]
+}
+
+## Kind of step by reply of server
+#
+STEPS = {
+    MESSAGES["SERVER_MOVE"]: "move",
+    MESSAGES["SERVER_TURN_LEFT"]: "turn",
+    MESSAGES["SERVER_TURN_RIGHT"]: "turn",
+    MESSAGES["SERVER_PICK_UP"]: "pickup",
+    MESSAGES["SERVER_LOGOUT"]: "logout"
+}
+
+## Robot driven by server over blocking socket
+#
+class Robot():
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param connection Connected socket
+    #  @param split If true, every message is sent in two writes
+    #  @param rng Random generator
+    #  @param obstacles Coordinates of obstacles
+    #
+    def __init__(self, connection, split, rng, obstacles) -> None:
+        self.connection = connection
+        self.split = split
+        self.obstacles = obstacles
+        self.position = (rng.randint(-6, 6), rng.randint(-6, 6))
+        while self.position in obstacles:
+            self.position = (rng.randint(-6, 6), rng.randint(-6, 6))
+        self.direction = rng.randrange(4)
+        self.buffer = b""
+        self.sent = None
+        self.steps = []
+
+    ## Send message
+    #
+    #  @param self
+    #  @param message Message without separation characters
+    #
+    def send(self, message):
+        data = message.encode("ascii") + b"\a\b"
+        self.sent = time.perf_counter()
+        if self.split:
+            self.connection.sendall(data[:len(data) // 2])
+            self.connection.sendall(data[len(data) // 2:])
+        else:
+            self.connection.sendall(data)
+
+    ## Receive one reply, round trip is recorded when robot was waiting for it
+    #
+    #  @param self
+    #  @param kind Kind of step, None to derive it from reply
+    #
+    #  @returns bytes Reply with separation characters
+    #
+    def receive(self, kind=None) -> bytes:
+        while b"\a\b" not in self.buffer:
+            data = self.connection.recv(1024)
+            if not data:
+                raise ConnectionError("Connection closed by server")
+            self.buffer += data
+        (message, _, self.buffer) = self.buffer.partition(b"\a\b")
+        reply = message + b"\a\b"
+        if self.sent is not None:
+            self.steps.append((kind or STEPS.get(reply, "other"), time.perf_counter() - self.sent))
+            self.sent = None
+        return reply
+
+    ## Log in and follow commands until logout
+    #
+    #  @param self
+    #
+    def run(self):
+        username = "Robot"
+        keyid = 1
+        name_hash = (sum(map(ord, username)) * 1000) % 65536
+        self.send(username)
+        self.receive("username")
+        self.send(str(keyid))
+        if self.receive("key_id") != str((name_hash + SERVER_KEY[keyid]) % 65536).encode("ascii") + b"\a\b":
+            raise ConnectionError("Unexpected confirmation")
+        self.send(str((name_hash + CLIENT_KEY[keyid]) % 65536))
+        self.receive("confirmation")
+
+        for _ in range(MOVE_LIMIT):
+            command = self.receive()
+            if command == MESSAGES["SERVER_MOVE"]:
+                target = (self.position[0] + DIRECTIONS[self.direction][0], self.position[1] + DIRECTIONS[self.direction][1])
+                if target not in self.obstacles:
+                    self.position = target
+            elif command == MESSAGES["SERVER_TURN_LEFT"]:
+                self.direction = (self.direction + 1) % 4
+            elif command == MESSAGES["SERVER_TURN_RIGHT"]:
+                self.direction = (self.direction - 1) % 4
+            elif command == MESSAGES["SERVER_PICK_UP"]:
+                self.send("Secret message")
+                self.receive()
+                return
+            else:
+                raise ConnectionError("Unexpected command " + repr(command))
+            self.send("OK " + str(self.position[0]) + " " + str(self.position[1]))
+        raise ConnectionError("Move limit exceeded")
+
+## Compute percentile of sorted values
+#
+#  @param values Sorted list of values
+#  @param percent Percentile (0 - 100)
+#
+#  @returns float|None Value or None if there are no values
+#
+def percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+## Find free local port
+#
+#  @returns int Port number
+#
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+## Start server with configuration and measure round trips of sessions against it
+#
+#  @param settings Parsed command line arguments
+#  @param arguments Server arguments of configuration
+#  @param split If true, robots send every message in two writes
+#
+#  @returns dict Round trip percentiles in milliseconds by kind of step
+#
+def measure(settings, arguments, split) -> dict:
+    port = free_port()
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server.py")
+    process = subprocess.Popen([sys.executable, server_path, str(port), "--engine", settings.engine] + arguments + settings.server_args.split(),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    rng = random.Random(settings.seed)
+    # Isolated obstacles, as expected by server specification
+    obstacles = set()
+    while len(obstacles) < 6:
+        (x, y) = (rng.randint(-6, 6), rng.randint(-6, 6))
+        if (x, y) != (0, 0) and not any((x + dx, y + dy) in obstacles for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+            obstacles.add((x, y))
+    steps = {}
+    try:
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+        for _ in range(settings.sessions):
+            with socket.create_connection(("127.0.0.1", port), 5) as connection:
+                robot = Robot(connection, split, rng, obstacles)
+                robot.run()
+            for (kind, duration) in robot.steps:
+                steps.setdefault(kind, []).append(duration)
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {}
+    for kind in ("username", "key_id", "confirmation", "move", "turn", "pickup", "logout"):
+        durations = sorted(steps.get(kind, []))
+        if durations:
+            report[kind] = {"count": len(durations),
+                            "p50_ms": round(percentile(durations, 50) * 1000, 3),
+                            "p99_ms": round(percentile(durations, 99) * 1000, 3)}
+    return report
+
+## Parse command line arguments
+#
+#  @returns argparse.Namespace Settings
+#
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measure round trip time of protocol steps with socket tuning options of BI-PSI server.")
+    parser.add_argument("--configurations", nargs="+", choices=list(CONFIGURATIONS), default=list(CONFIGURATIONS),
+                        help="compared configurations (default: all)")
+    parser.add_argument("--engine", choices=["threads", "asyncio", "selectors"], default="threads", help="engine of server (default: threads)")
+    parser.add_argument("--server-args", default="", help="additional arguments of server")
+    parser.add_argument("--sessions", type=int, default=20, help="number of sessions per configuration and way of sending (default: 20)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args()
+
+def main():
+    settings = parse_arguments()
+    results = {}
+    for name in settings.configurations:
+        for (mode, split) in (("whole", False), ("split", True)):
+            results[name + "/" + mode] = measure(settings, CONFIGURATIONS[name], split)
+
+    if settings.json:
+        print(json.dumps(results, indent=2))
+        return
+    kinds = ("username", "key_id", "confirmation", "move", "turn", "pickup")
+    print("round trip ms p50/p99".ljust(24) + "".join(kind.rjust(16) for kind in kinds))
+    for (name, report) in results.items():
+        print(name.ljust(24) + "".join((str(report[kind]["p50_ms"]) + "/" + str(report[kind]["p99_ms"]) if kind in report else "-").rjust(16)
+                                       for kind in kinds))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+
+
+## Memory benchmark of idle sessions of the BI-PSI server.
+#
+# Parks many authenticated robots in RECHARGING and reports bytes per idle session:
+#   - of the sans-IO session core, measured by tracemalloc in this process,
+#   - of each selected engine, measured as growth of resident memory of spawned server.
+#
+# Server engines are measured only with --engines, every robot needs its own connection (and file descriptor).
+
+import argparse
+import gc
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import server
+
+## Messages sent by robot which authenticates and starts recharging
+#
+def parking_messages(name="Robot", keyid=1) -> bytes:
+    name_hash = (sum(name.encode()) * 1000) % 65536
+    confirmation = (name_hash + server.CLIENT_KEY[keyid]) % 65536
+    return (name + "\a\b" + str(keyid) + "\a\b" + str(confirmation) + "\a\bRECHARGING\a\b").encode()
+
+## Measure memory of idle session cores
+#
+#  @param sessions Number of parked sessions
+#
+#  @returns dict Report
+#
+def measure_core(sessions) -> dict:
+    # Do not log every created session
+    server.LOGGER.configure(None, 0.0)
+    data = parking_messages()
+
+    # Warm up shared tables (validator automata, class attributes) so they are not counted
+    server.Session(("127.0.0.1", 1)).receive(data)
+    gc.collect()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    parked = []
+    for index in range(sessions):
+        session = server.Session(("127.0.0.1", 1024 + index % 60000))
+        session.receive(data)
+        parked.append(session)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert all(session.recharging for session in parked)
+    return {"sessions": sessions, "bytes_per_session": round((after - before) / sessions, 1)}
+
+## Read resident memory of process
+#
+#  @param pid Process id
+#
+#  @returns int Resident memory in bytes
+#
+def resident_memory(pid) -> int:
+    with open("/proc/" + str(pid) + "/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+## Measure memory of idle sessions served by spawned server
+#
+#  Robots refresh recharging before its timeout runs out, so all of them stay connected until measured.
+#
+#  @param engine Engine of server
+#  @param sessions Number of parked robots
+#  @param port Port for server
+#
+#  @returns dict Report
+#
+def measure_engine(engine, sessions, port) -> dict:
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server.py")
+    process = subprocess.Popen([sys.executable, server_path, str(port), "--engine", engine, "--backlog", "1024",
+                                "--max-sessions", "0", "--log-sample", "0"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    connections = []
+    try:
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        time.sleep(0.2)
+        before = resident_memory(process.pid)
+
+        data = parking_messages()
+        refresh = b"FULL POWER\a\bRECHARGING\a\b"
+        refreshed = time.monotonic()
+        for _ in range(sessions):
+            connection = socket.create_connection(("127.0.0.1", port))
+            connection.sendall(data)
+            connections.append(connection)
+            if time.monotonic() - refreshed > 2:
+                for connection in connections:
+                    connection.sendall(refresh)
+                refreshed = time.monotonic()
+
+        # Let server process everything, then measure
+        time.sleep(1)
+        after = resident_memory(process.pid)
+        alive = 0
+        for connection in connections:
+            connection.sendall(refresh)
+        time.sleep(0.2)
+        for connection in connections:
+            connection.setblocking(False)
+            try:
+                alive += connection.recv(1024) != b""
+            except BlockingIOError:
+                alive += 1
+            except OSError:
+                pass
+    finally:
+        for connection in connections:
+            connection.close()
+        process.terminate()
+        process.wait()
+
+    return {"engine": engine, "sessions": sessions, "alive": alive, "bytes_per_session": round((after - before) / sessions, 1)}
+
+## Parse command line arguments
+#
+#  @returns argparse.Namespace Settings
+#
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measure memory of idle (recharging) sessions of BI-PSI server.")
+    parser.add_argument("--sessions", type=int, default=10000, help="number of parked sessions of session core (default: 10000)")
+    parser.add_argument("--engines", nargs="*", default=[], choices=["threads", "asyncio", "selectors"],
+                        help="also measure spawned server with these engines")
+    parser.add_argument("--connections", type=int, default=2000, help="number of parked robots per engine (default: 2000)")
+    parser.add_argument("--port", type=int, default=4099, help="port of spawned servers (default: 4099)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args()
+
+def main():
+    settings = parse_arguments()
+    results = {"core": measure_core(settings.sessions)}
+    for engine in settings.engines:
+        results[engine] = measure_engine(engine, settings.connections, settings.port)
+
+    if settings.json:
+        print(json.dumps(results, indent=2))
+        return
+    for (name, result) in results.items():
+        print(name.ljust(10) + str(result["bytes_per_session"]).rjust(10) + " bytes per idle session (" + str(result["sessions"]) + " sessions"
+              + (", " + str(result["alive"]) + " alive)" if "alive" in result else ")"))
+
+if __name__ == "__main__":
+    main()
@@ -13,40 +13,1835 @@ import socket
 import sys
 import threading
 import enum
+import argparse
+import asyncio
+import os
+import selectors
+import signal
+import time
+import heapq
+import collections
+import bisect
+import http.server
+import json
+import random
+import atexit
+import itertools
+import mmap
+import struct
+import subprocess
+import secrets
+import tempfile
+import fcntl
+import functools
+import urllib.parse
 
 # Global variables defined by server specification
 HOST = '127.0.0.1'
 port = None
+options = None
+
+RECV_SIZE = 1024
+MESSAGE_MAX_LENGTH = 100
+
+TIMEOUT = 1
+TIMEOUT_RECHARGING = 5
 
 SERVER_KEY = [23019, 32037, 18789, 16443, 18189]
 CLIENT_KEY = [32037, 29295, 13603, 29533, 21952]
 
-MESSAGES = {
-    "SERVER_SYNTAX_ERROR": "301 SYNTAX ERROR\a\b".encode("ascii"),
-    "SERVER_LOGIC_ERROR": "302 LOGIC ERROR\a\b".encode("ascii"),
-    "SERVER_LOGOUT": "106 LOGOUT\a\b".encode("ascii"),
-    "SERVER_KEY_REQUEST": "107 KEY REQUEST\a\b".encode("ascii"),
-    "SERVER_LOGIN_FAILED": "300 LOGIN FAILED\a\b".encode("ascii"),
-    "SERVER_KEY_OUT_OF_RANGE_ERROR": "303 KEY OUT OF RANGE\a\b".encode("ascii"),
-    "SERVER_OK": "200 OK\a\b".encode("ascii"),
-    "SERVER_MOVE": "102 MOVE\a\b".encode("ascii"),
-    "SERVER_TURN_LEFT": "103 TURN LEFT\a\b".encode("ascii"),
-    "SERVER_TURN_RIGHT": "104 TURN RIGHT\a\b".encode("ascii"),
-    "SERVER_PICK_UP": "105 GET MESSAGE\a\b".encode("ascii")
-};
+MESSAGES = {
+    "SERVER_SYNTAX_ERROR": "301 SYNTAX ERROR\a\b".encode("ascii"),
+    "SERVER_LOGIC_ERROR": "302 LOGIC ERROR\a\b".encode("ascii"),
+    "SERVER_LOGOUT": "106 LOGOUT\a\b".encode("ascii"),
+    "SERVER_KEY_REQUEST": "107 KEY REQUEST\a\b".encode("ascii"),
+    "SERVER_LOGIN_FAILED": "300 LOGIN FAILED\a\b".encode("ascii"),
+    "SERVER_KEY_OUT_OF_RANGE_ERROR": "303 KEY OUT OF RANGE\a\b".encode("ascii"),
+    "SERVER_OK": "200 OK\a\b".encode("ascii"),
+    "SERVER_MOVE": "102 MOVE\a\b".encode("ascii"),
+    "SERVER_TURN_LEFT": "103 TURN LEFT\a\b".encode("ascii"),
+    "SERVER_TURN_RIGHT": "104 TURN RIGHT\a\b".encode("ascii"),
+    "SERVER_PICK_UP": "105 GET MESSAGE\a\b".encode("ascii")
+};
+
+
+## Class splitting received bytes into messages terminated by separation characters
+#
+#  Data are received directly into one reusable buffer and messages are returned as views into it, so no data are copied per message.
+#  Search for separation characters continues where the last search ended, so every received byte is scanned only once.
+#  Buffer is held only while there are received data, idle framer returns it to pool shared by all framers of process.
+#
+class Framer():
+
+    __slots__ = ("capacity", "buffer", "view", "start", "end", "scan")
+
+    ## Free buffers (with their views) of idle framers by capacity
+    #
+    pools = {}
+
+    ## Maximum number of free buffers kept in pool of each capacity
+    #
+    POOL_SIZE = 64
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param capacity Size of buffer, needs to fit received chunk together with longest unfinished message
+    #
+    def __init__(self, capacity) -> None:
+        self.capacity = capacity
+        self.buffer = None
+        self.view = None
+        self.start = 0
+        self.end = 0
+        self.scan = 0
+
+    ## Return buffer to pool if there are no unprocessed data in it
+    #
+    #  Views returned by next_message are not valid anymore.
+    #
+    #  @param self
+    #
+    def release(self):
+        if self.buffer is None or self.start != self.end:
+            return
+        pool = Framer.pools.setdefault(self.capacity, [])
+        if len(pool) < Framer.POOL_SIZE:
+            pool.append((self.buffer, self.view))
+        self.buffer = self.view = None
+        self.start = self.end = self.scan = 0
+
+    ## Get free part of buffer to receive data into
+    #
+    #  Moves unfinished message (bounded by message length limits) to the beginning of buffer first.
+    #
+    #  @param self
+    #
+    #  @returns memoryview Writable view of free part of buffer
+    #
+    def writable(self) -> memoryview:
+        if self.buffer is None:
+            try:
+                (self.buffer, self.view) = Framer.pools[self.capacity].pop()
+            except (KeyError, IndexError):
+                self.buffer = bytearray(self.capacity)
+                self.view = memoryview(self.buffer)
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+        elif self.start > 0:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.scan -= self.start
+            self.start = 0
+            self.end = pending
+        return self.view[self.end:]
+
+    ## Mark data received into writable part of buffer as valid
+    #
+    #  @param self
+    #  @param size Number of received bytes
+    #
+    def written(self, size):
+        self.end += size
+
+    ## Extract next complete message
+    #
+    #  Returned view is valid only until buffer is written into again.
+    #
+    #  @param self
+    #
+    #  @returns memoryview|None Message without separation characters or None if there is no complete message
+    #
+    def next_message(self):
+        if self.buffer is None:
+            return None
+        position = self.buffer.find(b"\a\b", self.scan, self.end)
+        if position == -1:
+            # Separation characters can be split between receives
+            self.scan = max(self.start, self.end - 1)
+            return None
+        message = self.view[self.start:position]
+        self.start = self.scan = position + 2
+        return message
+
+    ## Get data of unfinished message
+    #
+    #  @param self
+    #
+    #  @returns memoryview Received data not yet extracted as message
+    #
+    def pending(self) -> memoryview:
+        if self.buffer is None:
+            return memoryview(b"")
+        return self.view[self.start:self.end]
+
+
+## Class queueing frames to be sent to client
+#
+#  All frames produced while handling one receive are sent together by one send (or sendmsg, which gathers frames without joining them),
+#  mostly the shared MESSAGES byte strings themselves. Partially sent frame stays queued from the first unsent byte.
+#
+class WriteQueue():
+
+    __slots__ = ("frames", "size")
+
+    ## Number of queued bytes above which session stops reading from client until the queue is sent
+    #
+    high_water = 65536
+
+    ## Maximum number of buffers gathered by one sendmsg (IOV_MAX)
+    #
+    GATHER_MAX = 1024
+
+    ## Constructor
+    #
+    #  @param self
+    #
+    def __init__(self) -> None:
+        self.frames = []
+        self.size = 0
+
+    ## Queue frames
+    #
+    #  @param self
+    #  @param frames Bytes-like frames
+    #
+    def push(self, frames):
+        self.frames += frames
+        self.size += sum(map(len, frames))
+
+    ## Check if there is nothing to send
+    #
+    #  @param self
+    #
+    #  @returns bool Queue is empty
+    #
+    def empty(self) -> bool:
+        return not self.frames
+
+    ## Check if client reads slower than it sends
+    #
+    #  @param self
+    #
+    #  @returns bool Queued bytes exceed high water mark
+    #
+    def above_high_water(self) -> bool:
+        return self.size > WriteQueue.high_water
+
+    ## Send as much of queue as connection accepts
+    #
+    #  Non-blocking connection sends until it would block, connection with timeout raises socket.timeout when client does not read.
+    #
+    #  @param self
+    #  @param connection Connection to client
+    #
+    #  @returns bool Whole queue was sent
+    #
+    def flush(self, connection) -> bool:
+        while self.frames:
+            try:
+                if len(self.frames) == 1:
+                    sent = connection.send(self.frames[0])
+                else:
+                    sent = connection.sendmsg(self.frames[:WriteQueue.GATHER_MAX])
+            except (BlockingIOError, InterruptedError):
+                return False
+            METRIC_SEND_CALLS.inc()
+            if sent == self.size:
+                self.frames.clear()
+                self.size = 0
+                return True
+            self.size -= sent
+
+            # Drop sent frames, keep unsent rest of partially sent one
+            count = 0
+            while count < len(self.frames) and sent >= len(self.frames[count]):
+                sent -= len(self.frames[count])
+                count += 1
+            del self.frames[:count]
+            if sent:
+                self.frames[0] = memoryview(self.frames[0])[sent:]
+        return True
+
+
+## Class validating unfinished message incrementally as its bytes arrive
+#
+#  Syntax and length limit of message expected in each protocol phase are compiled into deterministic finite automaton (transition table).
+#  Every received byte is checked by one table lookup, bytes already checked are never scanned again.
+#
+class Validator():
+
+    __slots__ = ("table", "state", "consumed")
+
+    ## Kinds of expected message, each has its own automaton
+    #
+    USERNAME = 0
+    KEY_ID = 1
+    CONFIRMATION = 2
+    POSITION = 3
+    MESSAGE = 4
+    RECHARGING = 5
+
+    ## Grammars of message content, state is small int, None when message can no longer match
+    #
+    @staticmethod
+    def grammar_any(state, byte):
+        return state
+
+    @staticmethod
+    def grammar_digits(state, byte):
+        return state if 48 <= byte <= 57 else None
+
+    ## Grammar of "OK <x> <y>" message with optional minus sign of both coordinates
+    #
+    @staticmethod
+    def grammar_position(state, byte):
+        digit = 48 <= byte <= 57
+        if state == 0:
+            return 1 if byte == 79 else None            # O
+        if state == 1:
+            return 2 if byte == 75 else None            # K
+        if state == 2:
+            return 3 if byte == 32 else None            # space before x
+        if state == 3 or state == 6:
+            if byte == 45:                              # minus sign
+                return state + 1
+            return state + 2 if digit else None
+        if state == 4 or state == 7:
+            return state + 1 if digit else None         # first digit after minus sign
+        if state == 5 and byte == 32:
+            return 6                                    # space before y
+        if state == 5 or state == 8:
+            return state if digit else None
+        return None
+
+    ## Grammar, length limit and whether prefix of recharging message is allowed, for each kind of message
+    #
+    SPECIFICATION = {
+        USERNAME: (grammar_any, 18, True),
+        KEY_ID: (grammar_digits, 3, True),
+        CONFIRMATION: (grammar_digits, 5, True),
+        POSITION: (grammar_position, 10, True),
+        MESSAGE: (grammar_any, 98, True),
+        RECHARGING: (grammar_any, 10, False)
+    }
+
+    RECHARGING_MESSAGE = b"RECHARGING"
+
+    ## Transition tables of compiled automata, shared by all sessions
+    #
+    automata = {}
+
+    ## Compile automaton for given kind of message
+    #
+    #  State of automaton is tuple of grammar state, number of bytes of message, number of matched bytes of recharging message and flag whether last byte is "\a".
+    #  Last "\a" can be first of separation characters, so it is counted as part of message only when another byte arrives.
+    #  States are numbered in multiples of 256, so transition is found at index state + byte. State 0 means rejected message.
+    #
+    #  @param kind Kind of message
+    #
+    #  @returns list Transition table, initial state is 256
+    #
+    @staticmethod
+    def compile(kind) -> list:
+        grammar, limit, recharging_allowed = Validator.SPECIFICATION[kind]
+        recharging_message = Validator.RECHARGING_MESSAGE
+
+        # Bytes with special meaning, all other bytes behave the same
+        special = set(b"0123456789 -OK\a") | set(recharging_message)
+        other = next(byte for byte in range(256) if byte not in special)
+
+        def append(state, byte):
+            syntax, length, matched, alarm = state
+            if syntax is not None:
+                syntax = grammar.__func__(syntax, byte)
+            if matched is not None:
+                if matched < len(recharging_message) and recharging_message[matched] == byte:
+                    matched += 1
+                else:
+                    matched = None
+            length += 1
+            if length > limit:
+                syntax = None
+            return (syntax, length, matched, alarm)
+
+        def step(state, byte):
+            if state[3]:
+                state = append(state, 7)[:3] + (False,)
+            if byte == 7:
+                state = state[:3] + (True,)
+            else:
+                state = append(state, byte)
+
+            syntax, length, matched, alarm = state
+            if alarm:
+                valid = matched == len(recharging_message) or syntax is not None
+            else:
+                valid = matched is not None or syntax is not None
+            return state if valid else None
+
+        initial = (0, 0, 0 if recharging_allowed else None, False)
+        states = [initial]
+        numbers = {initial: 1}
+        rows = []
+        for state in states:
+            transitions = {}
+            for byte in special | {other}:
+                target = step(state, byte)
+                if target is None:
+                    transitions[byte] = 0
+                    continue
+                if target not in numbers:
+                    states.append(target)
+                    numbers[target] = len(states)
+                transitions[byte] = numbers[target] * 256
+            rows.append([transitions.get(byte, transitions[other]) for byte in range(256)])
+
+        table = [0] * 256
+        for row in rows:
+            table += row
+        return table
+
+    ## Constructor
+    #
+    #  @param self
+    #
+    def __init__(self) -> None:
+        self.reset(Validator.USERNAME)
+
+    ## Start validating new message
+    #
+    #  @param self
+    #  @param kind Kind of message expected next
+    #
+    def reset(self, kind):
+        if kind not in Validator.automata:
+            Validator.automata[kind] = Validator.compile(kind)
+        self.table = Validator.automata[kind]
+        self.state = 256
+        self.consumed = 0
+
+    ## Validate newly received bytes of unfinished message
+    #
+    #  @param self
+    #  @param pending All received bytes of unfinished message, only those not validated yet are checked
+    #
+    #  @returns bool Message can still be valid
+    #
+    def feed(self, pending) -> bool:
+        table = self.table
+        state = self.state
+        for byte in pending[self.consumed:]:
+            state = table[state + byte]
+            if not state:
+                break
+        self.state = state
+        self.consumed = len(pending)
+        return state != 0
+
+
+## Class scheduling deadlines of sessions on hashed timer wheel
+#
+#  Deadlines are kept in slots of wheel by the tick in which they expire, so arming, re-arming and cancelling deadline takes constant time.
+#  Slots are checked only as time passes, deadline which has not expired yet costs nothing.
+#  Ticks with deadlines are also kept in heap, so the nearest one is found without scanning empty slots.
+#
+class TimerWheel():
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param resolution Length of one tick in seconds
+    #  @param size Number of slots, deadlines further than size ticks wrap around
+    #
+    def __init__(self, resolution=0.01, size=1024) -> None:
+        self.resolution = resolution
+        self.slots = [{} for _ in range(size)]
+        self.positions = {}
+        self.tick = int(time.monotonic() / resolution)
+        # Number of deadlines by tick, every tick in it is also in heap (removed from both once it has none)
+        self.counts = {}
+        self.ticks = []
+
+    ## Set deadline of key, replaces its previous deadline
+    #
+    #  @param self
+    #  @param key Object the deadline belongs to
+    #  @param deadline Time of deadline (time.monotonic)
+    #
+    def arm(self, key, deadline):
+        self.cancel(key)
+        tick = max(int(deadline / self.resolution), self.tick)
+        self.slots[tick % len(self.slots)][key] = deadline
+        self.positions[key] = tick
+        if tick in self.counts:
+            self.counts[tick] += 1
+        else:
+            self.counts[tick] = 1
+            heapq.heappush(self.ticks, tick)
+
+    ## Remove deadline of key
+    #
+    #  @param self
+    #  @param key Object the deadline belongs to
+    #
+    def cancel(self, key):
+        tick = self.positions.pop(key, None)
+        if tick is not None:
+            del self.slots[tick % len(self.slots)][key]
+            self.counts[tick] -= 1
+
+    ## Remove and return keys whose deadlines have passed
+    #
+    #  Checks slots of all ticks since last call (every slot at most once).
+    #
+    #  @param self
+    #  @param now Current time (time.monotonic)
+    #
+    #  @returns list Keys with expired deadline
+    #
+    def expire(self, now) -> list:
+        target = int(now / self.resolution)
+        expired = []
+        if self.positions:
+            steps = min(target - self.tick, len(self.slots) - 1)
+            for tick in range(target - steps, target + 1):
+                slot = self.slots[tick % len(self.slots)]
+                if not slot:
+                    continue
+                for key, deadline in list(slot.items()):
+                    if deadline <= now:
+                        del slot[key]
+                        self.counts[self.positions.pop(key)] -= 1
+                        expired.append(key)
+        self.tick = max(self.tick, target)
+        return expired
+
+    ## Get time until slot with nearest deadline should be checked
+    #
+    #  Ticks left without deadlines are dropped from top of heap, each once, so the call takes amortised constant time.
+    #
+    #  @param self
+    #  @param now Current time (time.monotonic)
+    #
+    #  @returns float|None Seconds to wait or None if there is no deadline
+    #
+    def timeout(self, now):
+        while self.ticks and self.counts[self.ticks[0]] == 0:
+            del self.counts[heapq.heappop(self.ticks)]
+        if not self.ticks:
+            return None
+        return max(0, (self.ticks[0] + 1) * self.resolution - now)
+
+
+## Class keeping obstacles and free cells found by all sessions in bitmaps shared by processes
+#
+#  One bit per cell of square field around zero coords in each bitmap, cells outside of it are not recorded.
+#  Bitmaps are memory-mapped from file, so they survive restarts and are shared by worker processes without reloading.
+#  Setting bit is not atomic between processes, concurrently found cell can be lost and is then simply found again.
+#
+class ObstacleMap():
+
+    MAGIC = b"BIPSIOBS"
+    VERSION = 2
+    HEADER = struct.Struct("<8sII")
+
+    ## Bitmaps in file
+    #
+    OBSTACLES = 0
+    CLEAR = 1
+
+    ## Constructor
+    #
+    #  Creates file if it does not exist.
+    #
+    #  @param self
+    #  @param path Path to file with bitmaps, if None bitmaps are kept in anonymous shared memory (shared only with forked workers)
+    #  @param radius Cells from -radius to radius - 1 on both axes are recorded
+    #
+    #  @throws ValueError If existing file is not compatible obstacle map
+    #
+    def __init__(self, path=None, radius=512) -> None:
+        self.radius = radius
+        self.side = 2 * radius
+        self.plane_size = (self.side * self.side + 7) // 8
+        size = self.HEADER.size + 2 * self.plane_size
+
+        if path is None:
+            self.map = mmap.mmap(-1, size)
+            self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION, radius)
+            return
+
+        with open(path, "a+b") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                file.write(self.HEADER.pack(self.MAGIC, self.VERSION, radius))
+                file.truncate(size)
+            elif os.fstat(file.fileno()).st_size != size:
+                raise ValueError("Obstacle map has different size")
+            self.map = mmap.mmap(file.fileno(), size)
+
+        if self.HEADER.unpack_from(self.map, 0) != (self.MAGIC, self.VERSION, radius):
+            self.map.close()
+            raise ValueError("Obstacle map has different format")
+
+    ## Get position of cell bit
+    #
+    #  @param self
+    #  @param plane Bitmap (OBSTACLES or CLEAR)
+    #  @param x Coordinate x
+    #  @param y Coordinate y
+    #
+    #  @returns tuple|None Byte offset in map and bit mask or None if cell is outside of map
+    #
+    def position(self, plane, x, y):
+        x += self.radius
+        y += self.radius
+        if 0 <= x < self.side and 0 <= y < self.side:
+            index = y * self.side + x
+            return (self.HEADER.size + plane * self.plane_size + (index >> 3), 1 << (index & 7))
+        return None
+
+    ## Record cell in bitmap
+    #
+    #  @param self
+    #  @param plane Bitmap (OBSTACLES or CLEAR)
+    #  @param x Coordinate x
+    #  @param y Coordinate y
+    #
+    def set(self, plane, x, y):
+        position = self.position(plane, x, y)
+        if position is not None:
+            self.map[position[0]] |= position[1]
+
+    ## Check if cell is recorded in bitmap
+    #
+    #  @param self
+    #  @param plane Bitmap (OBSTACLES or CLEAR)
+    #  @param x Coordinate x
+    #  @param y Coordinate y
+    #
+    #  @returns bool Cell is recorded
+    #
+    def get(self, plane, x, y) -> bool:
+        position = self.position(plane, x, y)
+        return position is not None and bool(self.map[position[0]] & position[1])
+
+    ## Record obstacle
+    #
+    #  @param self
+    #  @param x Coordinate x
+    #  @param y Coordinate y
+    #
+    def add(self, x, y):
+        self.set(self.OBSTACLES, x, y)
+
+    ## Check if cell is known obstacle
+    #
+    #  @param self
+    #  @param x Coordinate x
+    #  @param y Coordinate y
+    #
+    #  @returns bool Cell is obstacle
+    #
+    def contains(self, x, y) -> bool:
+        return self.get(self.OBSTACLES, x, y)
+
+    ## Record cell some robot has stood on
+    #
+    #  @param self
+    #  @param x Coordinate x
+    #  @param y Coordinate y
+    #
+    def add_clear(self, x, y):
+        self.set(self.CLEAR, x, y)
+
+    ## Check if some robot has stood on cell
+    #
+    #  @param self
+    #  @param x Coordinate x
+    #  @param y Coordinate y
+    #
+    #  @returns bool Cell is known to be clear
+    #
+    def contains_clear(self, x, y) -> bool:
+        return self.get(self.CLEAR, x, y)
+
+    ## Write bitmaps to file
+    #
+    #  @param self
+    #
+    def flush(self):
+        self.map.flush()
+
+
+## Class collecting metrics of server and rendering them in Prometheus text format
+#
+#  Metrics can be updated from any thread, every metric has its own lock.
+#
+class Metrics():
+
+    ## Metric with value for every label value
+    #
+    class Metric():
+
+        TYPE = "untyped"
+
+        ## Constructor
+        #
+        #  @param self
+        #  @param name Name of metric
+        #  @param description Help text of metric
+        #  @param label Name of label or None if metric has single value
+        #
+        def __init__(self, name, description, label=None) -> None:
+            self.name = name
+            self.description = description
+            self.label = label
+            self.values = {}
+            self.lock = threading.Lock()
+
+        ## Add amount to value
+        #
+        #  @param self
+        #  @param amount Amount to add
+        #  @param label Value of label
+        #
+        def inc(self, amount=1, label=None):
+            with self.lock:
+                self.values[label] = self.values.get(label, 0) + amount
+
+        ## Format labels of sample
+        #
+        #  @param self
+        #  @param label Value of label
+        #  @param extra Additional labels (already formatted)
+        #
+        #  @returns str Labels including braces or empty string
+        #
+        def labels(self, label, extra=""):
+            labels = [] if label is None else [self.label + '="' + str(label) + '"']
+            if extra:
+                labels.append(extra)
+            return "{" + ",".join(labels) + "}" if labels else ""
+
+        ## Render metric
+        #
+        #  @param self
+        #
+        #  @returns list Lines of text format
+        #
+        def render(self) -> list:
+            lines = ["# HELP " + self.name + " " + self.description, "# TYPE " + self.name + " " + self.TYPE]
+            with self.lock:
+                values = sorted(self.values.items(), key=lambda item: str(item[0]))
+            if not values and self.label is None:
+                values = [(None, 0)]
+            for (label, value) in values:
+                lines.append(self.name + self.labels(label) + " " + str(value))
+            return lines
+
+    ## Monotonically increasing metric
+    #
+    class Counter(Metric):
+        TYPE = "counter"
+
+    ## Metric which can go up and down
+    #
+    class Gauge(Metric):
+        TYPE = "gauge"
+
+        ## Subtract amount from value
+        #
+        #  @param self
+        #  @param amount Amount to subtract
+        #  @param label Value of label
+        #
+        def dec(self, amount=1, label=None):
+            self.inc(-amount, label)
+
+    ## Distribution of observed values in buckets
+    #
+    class Histogram(Metric):
+        TYPE = "histogram"
+
+        ## Constructor
+        #
+        #  @param self
+        #  @param name Name of metric
+        #  @param description Help text of metric
+        #  @param buckets Sorted upper bounds of buckets
+        #
+        def __init__(self, name, description, buckets) -> None:
+            Metrics.Metric.__init__(self, name, description)
+            self.buckets = buckets
+            self.counts = [0] * (len(buckets) + 1)
+            self.sum = 0
+            self.count = 0
+
+        ## Record observed value
+        #
+        #  @param self
+        #  @param value Observed value
+        #
+        def observe(self, value):
+            index = bisect.bisect_left(self.buckets, value)
+            with self.lock:
+                self.counts[index] += 1
+                self.sum += value
+                self.count += 1
+
+        ## Render metric
+        #
+        #  @param self
+        #
+        #  @returns list Lines of text format
+        #
+        def render(self) -> list:
+            lines = ["# HELP " + self.name + " " + self.description, "# TYPE " + self.name + " " + self.TYPE]
+            with self.lock:
+                counts = self.counts[:]
+                (total, count) = (self.sum, self.count)
+            cumulative = 0
+            for (bound, bucket) in zip(self.buckets + [float("inf")], counts):
+                cumulative += bucket
+                lines.append(self.name + '_bucket{le="' + ("+Inf" if bound == float("inf") else str(bound)) + '"} ' + str(cumulative))
+            lines.append(self.name + "_sum " + str(total))
+            lines.append(self.name + "_count " + str(count))
+            return lines
+
+    ## Constructor
+    #
+    #  @param self
+    #
+    def __init__(self) -> None:
+        self.metrics = []
+
+    ## Create counter and register it
+    #
+    #  @returns Metrics.Counter
+    #
+    def counter(self, name, description, label=None):
+        self.metrics.append(Metrics.Counter(name, description, label))
+        return self.metrics[-1]
+
+    ## Create gauge and register it
+    #
+    #  @returns Metrics.Gauge
+    #
+    def gauge(self, name, description, label=None):
+        self.metrics.append(Metrics.Gauge(name, description, label))
+        return self.metrics[-1]
+
+    ## Create histogram and register it
+    #
+    #  @returns Metrics.Histogram
+    #
+    def histogram(self, name, description, buckets):
+        self.metrics.append(Metrics.Histogram(name, description, buckets))
+        return self.metrics[-1]
+
+    ## Render all registered metrics
+    #
+    #  @param self
+    #
+    #  @returns str Metrics in Prometheus text format
+    #
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+## Metrics of all sessions served by this process
+#
+METRICS = Metrics()
+METRIC_SESSIONS_ACTIVE = METRICS.gauge("robot_sessions_active", "Sessions currently connected")
+METRIC_SESSIONS_PHASE = METRICS.gauge("robot_sessions_phase", "Sessions currently connected by authentication phase", "phase")
+METRIC_SESSIONS_ENDED = METRICS.counter("robot_sessions_ended_total", "Sessions ended by reason", "reason")
+METRIC_BYTES_RECEIVED = METRICS.counter("robot_received_bytes_total", "Bytes received from robots")
+METRIC_BYTES_SENT = METRICS.counter("robot_sent_bytes_total", "Bytes sent to robots")
+METRIC_SESSIONS_REJECTED = METRICS.counter("robot_sessions_rejected_total", "Connections rejected because all session slots were taken or client exceeded its rate", "reason")
+METRIC_SEND_CALLS = METRICS.counter("robot_send_calls_total", "Send system calls made to send replies (writes to transport with asyncio engine)")
+METRIC_SESSIONS_RESUMED = METRICS.counter("robot_sessions_resumed_total", "Sessions resumed with tickets")
+METRIC_RECHARGES = METRICS.counter("robot_recharges_total", "Recharging periods started by robots")
+METRIC_HANDSHAKE = METRICS.histogram("robot_handshake_seconds", "Time from connection to successful authentication",
+                                     [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+METRIC_PROCESSING = METRICS.histogram("robot_message_processing_seconds", "Server time spent processing one message",
+                                      [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01])
+METRIC_MOVES = METRICS.histogram("robot_session_moves", "Move and turn commands sent per authenticated session",
+                                 [5, 10, 15, 20, 25, 30, 40, 50, 75, 100, 150, 200])
+METRIC_OBSTACLE_HITS = METRICS.histogram("robot_session_obstacle_hits", "Obstacles bumped into per authenticated session",
+                                         [0, 1, 2, 3, 4, 5, 7, 10, 15, 20])
+
+## Reasons of session end determined by the last message sent to client
+#
+END_REASONS = {
+    MESSAGES["SERVER_SYNTAX_ERROR"]: "syntax_error",
+    MESSAGES["SERVER_LOGIC_ERROR"]: "logic_error",
+    MESSAGES["SERVER_LOGOUT"]: "logout",
+    MESSAGES["SERVER_LOGIN_FAILED"]: "login_failed",
+    MESSAGES["SERVER_KEY_OUT_OF_RANGE_ERROR"]: "key_out_of_range"
+}
+
+
+## Handler of requests on local admin port
+#
+class AdminHandler(http.server.BaseHTTPRequestHandler):
+
+    ## Send response with body
+    #
+    #  @param self
+    #  @param body Body of response (str)
+    #  @param content_type Content type of body
+    #
+    def respond(self, body, content_type):
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    ## Serve metrics and most expensive sessions
+    #
+    #  GET /metrics returns metrics, GET /sessions/top?n=N returns JSON of N live sessions which spent the most CPU time (with --accounting).
+    #
+    #  @param self
+    #
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/metrics":
+            self.respond(METRICS.render(), "text/plain; version=0.0.4")
+        elif url.path == "/sessions/top":
+            if not Session.accounting:
+                self.send_error(409, "Session accounting is disabled")
+                return
+            try:
+                count = int(urllib.parse.parse_qs(url.query).get("n", ["10"])[0])
+            except ValueError:
+                self.send_error(400)
+                return
+            self.respond(json.dumps(Session.top(count)), "application/json")
+        else:
+            self.send_error(404)
+
+    ## Start and stop profiler
+    #
+    #  POST /profile/start starts sampling, POST /profile/stop stops it and returns collapsed stacks.
+    #
+    #  @param self
+    #
+    def do_POST(self):
+        if self.path == "/profile/start":
+            if not PROFILER.start():
+                self.send_error(409, "Profiler is already running")
+                return
+            LOGGER.log("profile_started")
+            self.respond("OK\n", "text/plain")
+        elif self.path == "/profile/stop":
+            if not PROFILER.running():
+                self.send_error(409, "Profiler is not running")
+                return
+            self.respond(PROFILER.stop(), "text/plain")
+        else:
+            self.send_error(404)
+
+    ## Do not log requests
+    #
+    def log_message(self, format, *args):
+        pass
+
+
+## Class writing structured log (JSON lines) from background thread
+#
+#  Records are handed to writer thread through bounded deque (appending and popping is atomic, no lock is taken), serialized and written there.
+#  If the queue is full, records are dropped instead of waiting. Events of sessions are sampled and rate limited per event,
+#  numbers of suppressed and dropped records are logged by writer once per second.
+#
+class Logger():
+
+    ## Constructor
+    #
+    #  Writer thread is started with the first record (again in forked worker process).
+    #
+    #  @param self
+    #  @param stream Stream to write to, standard output if None
+    #  @param capacity Maximum number of records waiting for writer
+    #
+    def __init__(self, stream=None, capacity=65536) -> None:
+        self.stream = stream
+        self.capacity = capacity
+        self.queue = collections.deque()
+        self.rate = None
+        self.sample = 1.0
+        self.buckets = {}
+        self.suppressed = {}
+        self.dropped = 0
+        self.writer = None
+        self.pid = None
+        self.closing = False
+        self.lock = threading.Lock()
+
+    ## Set sampling and rate limit of session events
+    #
+    #  @param self
+    #  @param rate Maximum number of records per second of every session event or None for unlimited
+    #  @param sample Ratio of session events which are logged
+    #
+    def configure(self, rate, sample):
+        self.rate = rate
+        self.sample = sample
+        self.buckets = {}
+
+    ## Decide if session event should be logged (sampling and token bucket per event)
+    #
+    #  @param self
+    #  @param event Name of event
+    #
+    #  @returns bool Event should be logged
+    #
+    def admit(self, event) -> bool:
+        if self.sample < 1.0 and random.random() >= self.sample:
+            self.suppressed[event] = self.suppressed.get(event, 0) + 1
+            return False
+        if self.rate is None:
+            return True
+
+        now = time.monotonic()
+        bucket = self.buckets.get(event)
+        if bucket is None:
+            bucket = self.buckets[event] = [self.rate, now]
+        bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            self.suppressed[event] = self.suppressed.get(event, 0) + 1
+            return False
+        bucket[0] -= 1
+        return True
+
+    ## Log event, never blocks
+    #
+    #  @param self
+    #  @param event Name of event
+    #  @param level Level of record ("info" or "error")
+    #  @param session Session the event belongs to or None for events of server
+    #  @param limited Sample and rate limit event even without session (events caused by clients)
+    #  @param fields Additional fields of record
+    #
+    def log(self, event, level="info", session=None, limited=False, **fields):
+        if (session is not None or limited) and not self.admit(event):
+            return
+        if session is not None:
+            fields["session"] = session.id
+            fields["address"] = session.address[0] + ":" + str(session.address[1])
+            fields["phase"] = session.authentication.phase.name
+
+        if self.pid != os.getpid():
+            self.start()
+
+        if len(self.queue) >= self.capacity:
+            self.dropped += 1
+            return
+        self.queue.append((time.time(), level, event, fields))
+
+    ## Start writer thread
+    #
+    #  Records inherited from parent process are discarded, parent writes them.
+    #
+    #  @param self
+    #
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                self.queue.clear()
+            self.pid = os.getpid()
+            self.closing = False
+            self.writer = threading.Thread(target=self.write, daemon=True)
+            self.writer.start()
+
+    ## Format record as JSON line
+    #
+    #  @param self
+    #  @param record Tuple of time, level, event and fields
+    #
+    #  @returns str Line without newline
+    #
+    def format(self, record) -> str:
+        (timestamp, level, event, fields) = record
+        line = {"time": round(timestamp, 6), "level": level, "event": event, "pid": self.pid}
+        line.update(fields)
+        return json.dumps(line)
+
+    ## Primary function of writer thread
+    #
+    #  @param self
+    #
+    def write(self):
+        stream = self.stream or sys.stdout
+        reported = time.monotonic()
+        while True:
+            if time.monotonic() - reported >= 1 or self.closing:
+                reported = time.monotonic()
+                (suppressed, self.suppressed) = (self.suppressed, {})
+                (dropped, self.dropped) = (self.dropped, 0)
+                if suppressed or dropped:
+                    self.queue.append((time.time(), "info", "log_suppressed", {"suppressed": suppressed, "dropped": dropped}))
+
+            if not self.queue:
+                if self.closing:
+                    break
+                time.sleep(0.05)
+                continue
+
+            lines = []
+            while self.queue:
+                lines.append(self.format(self.queue.popleft()))
+            try:
+                stream.write("\n".join(lines) + "\n")
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    ## Write all queued records and stop writer thread
+    #
+    #  @param self
+    #
+    def close(self):
+        if self.pid == os.getpid() and self.writer is not None:
+            self.closing = True
+            self.writer.join()
+            self.writer = None
+            self.pid = None
+
+
+## Log of this process
+#
+LOGGER = Logger()
+atexit.register(LOGGER.close)
+
+## Class limiting number of concurrently served sessions
+#
+#  Every engine takes a slot before it starts serving accepted connection and returns it when the session ends.
+#  Connections accepted while all slots are taken are rejected right away (reset), so a flood of robots cannot exhaust threads or memory.
+#
+class SessionSlots():
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param limit Maximum number of concurrent sessions or None for unlimited
+    #
+    def __init__(self, limit=None) -> None:
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    ## Take slot for new session
+    #
+    #  @param self
+    #
+    #  @returns bool Slot was taken, false if all slots are used
+    #
+    def acquire(self) -> bool:
+        with self.lock:
+            if self.limit is not None and self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    ## Return slot of ended session
+    #
+    #  @param self
+    #
+    def release(self):
+        with self.lock:
+            self.used -= 1
+
+    ## Prepare accepted connection to be rejected without serving it
+    #
+    #  Closing connection afterwards resets it (SO_LINGER with zero timeout), so it does not linger in TIME_WAIT and robot learns immediately.
+    #
+    #  @param connection Accepted socket (to be closed by caller)
+    #  @param address Tuple of IPv4 address and port of client
+    #  @param reason Reason of rejection ("slots" or "rate_limit")
+    #
+    @staticmethod
+    def reject(connection, address, reason="slots"):
+        METRIC_SESSIONS_REJECTED.inc(1, reason)
+        LOGGER.log("rejected", limited=True, address=address[0] + ":" + str(address[1]), reason=reason)
+        try:
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        except OSError:
+            pass
+
+
+## Session slots of this process
+#
+SLOTS = SessionSlots()
+
+
+## Class applying tuning options to listening sockets and accepted connections
+#
+#  With TCP_NODELAY replies are sent right away instead of waiting for acknowledgement of previous ones (Nagle's algorithm).
+#  With TCP_QUICKACK received data are acknowledged right away, so robot sending message in more segments does not wait for delayed acknowledgement.
+#  Kernel turns quick acknowledgements off again, so it is set after every receive.
+#
+class SocketTuning():
+
+    ## Constructor
+    #
+    #  @param self
+    #
+    def __init__(self) -> None:
+        self.nodelay = True
+        self.quickack = False
+        self.keepalive = False
+        self.rcvbuf = None
+        self.sndbuf = None
+
+    ## Apply buffer sizes to listening socket, accepted connections inherit them
+    #
+    #  Receive buffer needs to be set before listening, it determines window scaling of connections.
+    #
+    #  @param self
+    #  @param serversocket Listening server socket
+    #
+    def listening(self, serversocket):
+        if self.rcvbuf is not None:
+            serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.sndbuf is not None:
+            serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+
+    ## Apply options to accepted connection
+    #
+    #  @param self
+    #  @param connection Accepted socket
+    #
+    def accepted(self, connection):
+        try:
+            if self.nodelay:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.keepalive:
+                connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except OSError:
+            # Connection was already reset by client, serving it fails the usual way
+            pass
+        self.received(connection)
+
+    ## Acknowledge next received data right away (with quickack)
+    #
+    #  @param self
+    #  @param connection Connection to client
+    #
+    def received(self, connection):
+        if self.quickack:
+            try:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            except OSError:
+                pass
+
+## Socket tuning of this process
+#
+TUNING = SocketTuning()
+
+
+## Class limiting rate of accepted connections per client address (token bucket)
+#
+#  Every address gets burst tokens, refilled at rate per second, and every accepted connection takes one.
+#  Connections of address without token are rejected before any session is created for them.
+#  Only the least recently seen addresses are tracked over capacity. Used only by the thread accepting connections.
+#
+class AcceptLimiter():
+
+    ## Maximum number of tracked addresses
+    #
+    CAPACITY = 65536
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param rate Connections per second allowed from one address or None for unlimited
+    #  @param burst Connections allowed from one address at once
+    #
+    def __init__(self, rate=None, burst=20) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.buckets = collections.OrderedDict()
+
+    ## Take token for connection from address
+    #
+    #  @param self
+    #  @param host IPv4 address of client
+    #
+    #  @returns bool Connection can be served, false if address exceeded its rate
+    #
+    def admit(self, host) -> bool:
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        bucket = self.buckets.pop(host, None)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        admitted = tokens >= 1
+        self.buckets[host] = (tokens - 1 if admitted else tokens, now)
+        if len(self.buckets) > self.CAPACITY:
+            self.buckets.popitem(last=False)
+        return admitted
+
+## Accept rate limiter of this process
+#
+LIMITER = AcceptLimiter()
+
+
+## Class keeping state of interrupted sessions, which reconnected robots resume with tickets
+#
+#  Ticket is issued when robot logs in and can be redeemed once, resumed session gets a new one.
+#  State of session is stored under its ticket when the session is interrupted (closed connection, timeout, ...) and expires after lifetime.
+#  States are fixed size records in memory-mapped file shared by worker processes, a file given by path also survives hot restart.
+#  Every ticket can be stored in one of few slots, when all are taken the state expiring first is replaced.
+#  Position, direction (if still known) and up to OBSTACLES obstacles found by session are stored, visited cells are not.
+#
+class ResumptionTickets():
+
+    ## Reasons of end of session which robot can resume
+    #
+    REASONS = ("closed", "error", "timeout", "slow_reader")
+
+    MAGIC = b"BIPSITKT"
+    VERSION = 1
+    HEADER = struct.Struct("<8sII")
+
+    ## Maximum number of obstacles stored with state of session
+    #
+    OBSTACLES = 16
+
+    ## Stored state: ticket, expiration (time.time), flags, coords, direction (-1 if not known), number of obstacles and their coords
+    #
+    RECORD = struct.Struct("<11sdBiibB" + "ii" * OBSTACLES)
+    KEY = struct.Struct("<11sd")
+
+    ## Flags of stored state
+    #
+    POSITIONED = 1
+    SPECULATING = 2
+
+    ## Number of slots a ticket can be stored in
+    #
+    WAYS = 4
+
+    ## Constructor
+    #
+    #  Creates file if it does not exist.
+    #
+    #  @param self
+    #  @param path Path to file with states, if None states are kept in temporary file (shared only with forked workers)
+    #  @param capacity Number of slots for states
+    #  @param lifetime Seconds for which stored state can be resumed
+    #
+    #  @throws ValueError If existing file is not compatible ticket file
+    #
+    def __init__(self, path=None, capacity=4096, lifetime=60) -> None:
+        self.capacity = capacity
+        self.lifetime = lifetime
+        self.lock = threading.Lock()
+        size = self.HEADER.size + capacity * self.RECORD.size
+
+        # File stays open, processes lock it while accessing states
+        self.file = tempfile.TemporaryFile() if path is None else open(path, "a+b")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, capacity))
+            self.file.truncate(size)
+        elif os.fstat(self.file.fileno()).st_size != size:
+            self.file.close()
+            raise ValueError("Ticket file has different size")
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+        if self.HEADER.unpack_from(self.map, 0) != (self.MAGIC, self.VERSION, capacity):
+            self.map.close()
+            self.file.close()
+            raise ValueError("Ticket file has different format")
+
+    ## Create new ticket
+    #
+    #  @param self
+    #
+    #  @returns str Random ticket (11 characters), short enough to be sent instead of username
+    #
+    def issue(self) -> str:
+        return secrets.token_urlsafe(8)
+
+    ## Get offsets of slots ticket can be stored in
+    #
+    #  @param self
+    #  @param key Encoded ticket
+    #
+    #  @returns list Offsets of records in map
+    #
+    def slots(self, key) -> list:
+        first = int.from_bytes(key[:8], "little")
+        return [self.HEADER.size + (first + way) % self.capacity * self.RECORD.size for way in range(self.WAYS)]
+
+    ## Store state of interrupted session
+    #
+    #  @param self
+    #  @param ticket Ticket of session
+    #  @param movement Movement of session
+    #
+    def store(self, ticket, movement):
+        key = ticket.encode("ascii")
+        flags = 0
+        if movement.x is not None:
+            flags |= self.POSITIONED
+        if movement.speculating:
+            flags |= self.SPECULATING
+        direction = movement.direction.value if movement.direction_kept() else -1
+        obstacles = list(itertools.islice(movement.obstacles or (), self.OBSTACLES))
+        coords = [coord for obstacle in obstacles for coord in obstacle] + [0] * (2 * (self.OBSTACLES - len(obstacles)))
+        record = self.RECORD.pack(key, time.time() + self.lifetime, flags, movement.x or 0, movement.y or 0, direction, len(obstacles), *coords)
+
+        with self.lock:
+            fcntl.lockf(self.file, fcntl.LOCK_EX)
+            try:
+                # Free slot has expiration 0, else the state expiring first is replaced
+                offset = min(self.slots(key), key=lambda offset: self.KEY.unpack_from(self.map, offset)[1])
+                self.map[offset:offset + self.RECORD.size] = record
+            finally:
+                fcntl.lockf(self.file, fcntl.LOCK_UN)
+
+    ## Take stored state of session for resuming it
+    #
+    #  @param self
+    #  @param ticket Ticket presented by robot
+    #
+    #  @returns Movement|None Movement continuing interrupted session or None if ticket is unknown or expired
+    #
+    def redeem(self, ticket):
+        key = ticket.encode("utf-8")
+        if len(key) != self.KEY.size - 8:
+            return None
+        fields = None
+        with self.lock:
+            fcntl.lockf(self.file, fcntl.LOCK_EX)
+            try:
+                for offset in self.slots(key):
+                    if self.KEY.unpack_from(self.map, offset)[0] == key:
+                        fields = self.RECORD.unpack_from(self.map, offset)
+                        self.map[offset:offset + self.RECORD.size] = bytes(self.RECORD.size)
+                        break
+            finally:
+                fcntl.lockf(self.file, fcntl.LOCK_UN)
+        if fields is None or fields[1] < time.time():
+            return None
+
+        (flags, x, y, direction, count) = fields[2:7]
+        movement = Session.Movement([])
+        if flags & self.POSITIONED:
+            movement.x = x
+            movement.y = y
+        if direction >= 0:
+            # Direction was known after a move, see Movement.resume
+            movement.direction = Session.Movement.Direction(direction)
+            movement.last_moved = True
+        movement.speculating = bool(flags & self.SPECULATING)
+        if count:
+            movement.obstacles = set(zip(fields[7:7 + 2 * count:2], fields[8:8 + 2 * count:2]))
+        return movement
+
+
+## Class recording inbound and outbound data of all sessions into binary trace file
+#
+#  Trace starts with header (magic, version and JSON of server options affecting replies), followed by records appended as they happen.
+#  Every record is fixed size head (time, pid, session id, kind, length of data) followed by data.
+#  Records are collected in buffer and appended by one write, workers share the file opened for appending.
+#
+class Capture():
+
+    ## Identification of trace file
+    #
+    MAGIC = b"BIPSITRC"
+    VERSION = 1
+
+    ## Header of trace: magic, version and length of JSON with options
+    #
+    HEADER = struct.Struct("<8sII")
+
+    ## Head of record: time, pid, session id, kind and length of data
+    #
+    RECORD = struct.Struct("<dIIBI")
+
+    ## Kinds of records, data of OPEN is address of client and data of CLOSE reason of end
+    #
+    OPEN = 0
+    INBOUND = 1
+    OUTBOUND = 2
+    CLOSE = 3
+
+    ## Size of buffered records written at once
+    #
+    FLUSH_SIZE = 65536
+
+    ## Constructor
+    #
+    #  Creates (truncates) trace file and writes its header.
+    #
+    #  @param self
+    #  @param path Path to trace file
+    #  @param settings Options of server needed to replay the trace (dict)
+    #  @param append If true, continues trace written by old process (on hot restart), header is written only to empty file
+    #
+    def __init__(self, path, settings, append=False) -> None:
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | (0 if append else os.O_TRUNC) | os.O_APPEND, 0o644)
+        if os.fstat(self.fd).st_size == 0:
+            encoded = json.dumps(settings).encode("utf-8")
+            os.write(self.fd, self.HEADER.pack(self.MAGIC, self.VERSION, len(encoded)) + encoded)
+        self.buffer = bytearray()
+        self.flushed = time.monotonic()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.forked)
+
+    ## Forget state inherited from parent process
+    #
+    #  @param self
+    #
+    def forked(self):
+        self.buffer = bytearray()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    ## Record data of session
+    #
+    #  @param self
+    #  @param session Session the data belong to
+    #  @param kind Kind of record
+    #  @param data Bytes-like data
+    #
+    def record(self, session, kind, data):
+        head = self.RECORD.pack(time.time(), self.pid, session.id, kind, len(data))
+        with self.lock:
+            self.buffer += head
+            self.buffer += data
+            if len(self.buffer) >= self.FLUSH_SIZE or time.monotonic() - self.flushed >= 1:
+                self.flush()
+
+    ## Append buffered records to trace file, lock needs to be held
+    #
+    #  @param self
+    #
+    def flush(self):
+        if self.buffer:
+            try:
+                os.write(self.fd, self.buffer)
+            except OSError:
+                pass
+            self.buffer.clear()
+        self.flushed = time.monotonic()
+
+    ## Append all buffered records
+    #
+    #  @param self
+    #
+    def close(self):
+        with self.lock:
+            self.flush()
+
+
+
+## Class sampling stacks of all threads of process in background thread
+#
+#  Samples are aggregated as collapsed stacks ("frame;frame;frame count" lines), input of flamegraph tools.
+#  Nothing runs until started, so disabled profiler costs nothing.
+#
+class Profiler():
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param interval Seconds between samples
+    #
+    def __init__(self, interval=0.01) -> None:
+        self.interval = interval
+        self.sampler = None
+        self.stopping = None
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    ## Check if profiler is sampling
+    #
+    #  @param self
+    #
+    #  @returns bool Profiler is running
+    #
+    def running(self) -> bool:
+        return self.sampler is not None
+
+    ## Start sampling, previous samples are discarded
+    #
+    #  @param self
+    #
+    #  @returns bool Started, false if already running
+    #
+    def start(self) -> bool:
+        if self.running():
+            return False
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        return True
+
+    ## Primary function of sampling thread
+    #
+    #  @param self
+    #
+    def sample(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for (ident, frame) in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(code.co_name + " (" + os.path.basename(code.co_filename) + ":" + str(code.co_firstlineno) + ")")
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    ## Stop sampling
+    #
+    #  @param self
+    #
+    #  @returns str Collapsed stacks, one per line with number of samples
+    #
+    def stop(self) -> str:
+        if self.running():
+            self.stopping.set()
+            self.sampler.join()
+            self.sampler = None
+        return "".join(stack + " " + str(count) + "\n" for (stack, count) in self.stacks.most_common())
+
+
+## Profiler of this process
+#
+PROFILER = Profiler()
+
+## Start profiler, or stop it and write collapsed stacks to file (on SIGUSR2)
+#
+#  File is named by --profile-output with pid of process appended, so workers do not overwrite each other.
+#
+#  @param signum Number of signal
+#  @param frame Interrupted stack frame
+#
+def toggle_profiler(signum, frame):
+    if PROFILER.start():
+        LOGGER.log("profile_started")
+        return
+    path = options.profile_output + "." + str(os.getpid())
+    try:
+        with open(path, "w") as file:
+            file.write(PROFILER.stop())
+    except OSError:
+        LOGGER.log("profile_failed", "error", path=path)
+        return
+    LOGGER.log("profile_written", path=path, samples=PROFILER.samples)
+
+
+## Class handing listening sockets over to new server process on hot restart and draining sessions of the old one
+#
+#  SIGHUP starts server.py again with the same arguments, the new process inherits listening sockets (their fds are passed in environment).
+#  Once it serves, it sends SIGUSR1 to the old process, which stops accepting, lets its sessions finish and exits.
+#  Both processes accept from the same sockets meanwhile, so connections queue in the kernel and none is refused.
+#
+class HotRestart():
+
+    ## Environment variables with fds of inherited listening sockets and pid of process to drain
+    #
+    LISTEN_FDS = "BIPSI_LISTEN_FDS"
+    DRAIN_PID = "BIPSI_DRAIN_PID"
+
+    ## Interval of checking whether all sessions of draining process ended, in seconds
+    #
+    POLL = 0.05
+
+    ## Seconds for which restarted process waits for old one to release admin port
+    #
+    ADMIN_WAIT = 30
+
+    ## Constructor
+    #
+    #  @param self
+    #
+    def __init__(self) -> None:
+        self.sockets = []
+        self.inherited = None
+        self.drain_pid = None
+        self.process = None
+        self.draining = False
+        self.admin_server = None
+        self.pipe = None
+
+    ## Take over listening sockets passed by old server process, if this process was started by hot restart
+    #
+    #  @param self
+    #
+    #  @returns list|None Inherited sockets or None if not restarted
+    #
+    def inherit(self):
+        fds = os.environ.pop(self.LISTEN_FDS, None)
+        self.drain_pid = os.environ.pop(self.DRAIN_PID, None)
+        if fds is not None:
+            self.inherited = [socket.socket(fileno=int(fd)) for fd in fds.split(",")]
+        return self.inherited
+
+    ## Start new server process inheriting listening sockets (on SIGHUP)
+    #
+    #  @param self
+    #  @param signum Number of signal
+    #  @param frame Interrupted stack frame
+    #
+    def start(self, signum, frame):
+        if self.draining or (self.process is not None and self.process.poll() is None):
+            return
+        fds = [serversocket.fileno() for serversocket in self.sockets]
+        environment = dict(os.environ)
+        environment[self.LISTEN_FDS] = ",".join(str(fd) for fd in fds)
+        environment[self.DRAIN_PID] = str(os.getpid())
+        try:
+            self.process = subprocess.Popen([sys.executable] + sys.argv, pass_fds=fds, env=environment)
+        except OSError:
+            LOGGER.log("restart_failed", "error")
+            return
+        LOGGER.log("restart_started", pid=self.process.pid)
+
+    ## Tell old server process to drain, this process serves now
+    #
+    #  @param self
+    #
+    def ready(self):
+        if self.drain_pid is None:
+            return
+        try:
+            os.kill(int(self.drain_pid), signal.SIGUSR1)
+        except ProcessLookupError:
+            pass
+        LOGGER.log("restarted", drained=int(self.drain_pid))
+        self.drain_pid = None
+
+    ## Create pipe waking up serving loop of this process when it starts draining
+    #
+    #  @param self
+    #
+    #  @returns int Fd to be selected for reading
+    #
+    def wakeup(self) -> int:
+        self.pipe = os.pipe()
+        os.set_blocking(self.pipe[1], False)
+        if self.draining:
+            os.write(self.pipe[1], b"\0")
+        return self.pipe[0]
+
+    ## Stop accepting new sessions and let served ones finish (on SIGUSR1)
+    #
+    #  Admin port is released right away, so the new process can serve metrics.
+    #
+    #  @param self
+    #  @param signum Number of signal
+    #  @param frame Interrupted stack frame
+    #
+    def drain(self, signum, frame):
+        if self.draining:
+            return
+        self.draining = True
+        LOGGER.log("draining", sessions=SLOTS.used)
+        if self.pipe is not None:
+            os.write(self.pipe[1], b"\0")
+        if self.admin_server is not None:
+            threading.Thread(target=self.close_admin_server, args=(self.admin_server,), daemon=True).start()
+            self.admin_server = None
+
+    ## Stop serving admin port
+    #
+    #  @param admin_server Admin HTTP server
+    #
+    @staticmethod
+    def close_admin_server(admin_server):
+        admin_server.shutdown()
+        admin_server.server_close()
+
+    ## Wait until all sessions of this process end
+    #
+    #  @param self
+    #
+    def wait_for_sessions(self):
+        while SLOTS.used:
+            time.sleep(self.POLL)
+
+RESTART = HotRestart()
 
 
 ## Class implementing all of server logic after communication has been initialized
 #
-class ServerThread(threading.Thread):
+#  Protocol core independent of the way the client is served (sans-IO).
+#  Transports pass received bytes to it, send back returned frames and apply its timeout.
+#
+class Session():
+
+    __slots__ = ("id", "address", "framer", "validator", "outbox", "authentication", "movement",
+                 "active", "recharging", "timeout", "started", "end_reason", "finished", "usage", "received_bytes")
+
+    ## Source of session ids
+    #
+    ids = itertools.count(1)
+
+    ## Capture recording data of all sessions, None if disabled
+    #
+    capture = None
+
+    ## If true, CPU time and number of calls of parts of processing are accounted per session
+    #
+    accounting = False
+
+    ## Accounted parts of processing: transport loop iteration, handle_data, authentication and movement
+    #
+    PARTS = ("run", "handle_data", "authentication", "movement")
+    RUN = 0
+    HANDLE_DATA = 1
+    AUTHENTICATION = 2
+    MOVEMENT = 3
+
+    ## Live accounted sessions by id
+    #
+    live = {}
+
+    ## Budget of session: maximum duration in seconds and maximum number of received bytes, None for unlimited
+    #
+    #  Length of every message is limited by protocol, unfinished message is rejected as soon as it is too long.
+    #
+    time_budget = None
+    byte_budget = None
 
     ## Class for processing client authentication
     #
     class Authentication():
 
-        ## Defines phases of authentication protocol as enum
+        __slots__ = ("outbox", "phase", "hash", "username", "keyid", "ticket", "resumed")
+
+        ## Store of resumption tickets (ResumptionTickets) or None if resumption is disabled
+        #
+        tickets = None
+
+        ## Prefix of username of robot resuming session with ticket
+        #
+        RESUME = "RESUME "
+
+        ## Defines phases of authentication protocol as small int codes
         #
-        class AuthenticationPhase(enum.Enum):
+        class AuthenticationPhase(enum.IntEnum):
             USERNAME = 0
             KEY_ID = 1
             CONFIRMATION = 2
@@ -55,32 +1850,34 @@ class ServerThread(threading.Thread):
         ## Constructor
         #
         #  @param self
-        #  @param connection Connection to client
+        #  @param outbox List collecting frames to be sent to client
         #
-        def __init__(self, connection) -> None:
-            self.connection = connection
+        def __init__(self, outbox) -> None:
+            self.outbox = outbox
             self.phase = self.AuthenticationPhase.USERNAME
+            self.ticket = None
+            self.resumed = None
 
         ## Check if message length is valid before processing it
         #
         #  Calculates whether the message fits the expected length.
         #
         #  @param self
-        #  @param data Received message
+        #  @param data Received message (bytes-like, not decoded)
         #  
         #  @returns bool Valid length
         #
         def verify_length(self, data) -> bool:
             # Check if contains part of message separation characters
             prefix_size = 0
-            if len(data) != 0 and data[-1] == "\a":
+            if data[-1:] == b"\a":
                 prefix_size += 1
 
             # Check for halt message
-            recharging_check_string = "RECHARGING\a\b"
+            recharging_check_string = b"RECHARGING\a\b"
             recharging_check_string_trucated = recharging_check_string[0:len(data)]
 
-            if data.startswith(recharging_check_string_trucated):
+            if data[0:len(recharging_check_string_trucated)] == recharging_check_string_trucated:
                 if len(data) > 10 + prefix_size:
                     return False
                 else:
@@ -100,19 +1897,58 @@ class ServerThread(threading.Thread):
 
         ## Calculate hash as expected by server specification
         #
+        #  @param username Username
+        #
+        #  @returns int Hash
+        #
+        @staticmethod
+        def calculate_hash(username) -> int:
+            return (sum(map(ord, username)) * 1000) % 65536
+
+        ## Hash of username and confirmation message of server for key id, cached for reconnecting robots
+        #
+        #  @param username Username
+        #  @param keyid Key id (0 - 4)
+        #
+        #  @returns tuple Hash and encoded confirmation message
+        #
+        @staticmethod
+        @functools.lru_cache(maxsize=4096)
+        def confirmation(username, keyid) -> tuple:
+            name_hash = Session.Authentication.calculate_hash(username)
+            return (name_hash, f"{(name_hash + SERVER_KEY[keyid]) % 65536}\a\b".encode("ascii"))
+
+        ## Queue new resumption ticket
+        #
         #  @param self
         #
-        def calculate_hash(self):
-            self.hash = 0
-            for c in self.username:
-                self.hash += ord(c)
-            self.hash *= 1000
-            self.hash %= 65536
+        def issue_ticket(self):
+            self.ticket = self.tickets.issue()
+            self.outbox.append(("108 TICKET " + self.ticket + "\a\b").encode("ascii"))
+
+        ## Resume interrupted session with ticket instead of logging in
+        #
+        #  Stored movement is kept in resumed, to be continued by session.
+        #
+        #  @param self
+        #  @param ticket Ticket presented by robot
+        #
+        #  @returns bool If true session is resumed, else ticket is unknown or expired and nothing is queued
+        #
+        def resume(self, ticket) -> bool:
+            self.resumed = self.tickets.redeem(ticket)
+            if self.resumed is None:
+                return False
+
+            self.phase = self.AuthenticationPhase.AUTHENTICATED
+            self.outbox.append(MESSAGES["SERVER_OK"])
+            self.issue_ticket()
+            return True
 
         ## Process received authentication message
         #
         #  @param self
-        #  @param data Received message
+        #  @param data Received message with already verified length
         #
         #  @returns bool If true authentication is valid, else should terminate connection
         #
@@ -122,43 +1958,37 @@ class ServerThread(threading.Thread):
             global CLIENT_KEY
             global MESSAGES
 
-            # Check for correct length
-            if not self.verify_length(data):
-                self.connection.send(MESSAGES["SERVER_SYNTAX_ERROR"])
-                return False
-
             # Perform required action based on authetication phase defined by server specification
             if self.phase == self.AuthenticationPhase.USERNAME:
+                if self.tickets is not None and data.startswith(self.RESUME) and self.resume(data[len(self.RESUME):]):
+                    return True
+                # Robot with unknown or expired ticket logs in with the message as its username
                 self.username = data
 
                 self.phase = self.AuthenticationPhase.KEY_ID
-                self.connection.send(MESSAGES["SERVER_KEY_REQUEST"])
+                self.outbox.append(MESSAGES["SERVER_KEY_REQUEST"])
                 return True
 
             elif self.phase == self.AuthenticationPhase.KEY_ID:
                 if not data.isdecimal():
-                    self.connection.send(MESSAGES["SERVER_SYNTAX_ERROR"])  
+                    self.outbox.append(MESSAGES["SERVER_SYNTAX_ERROR"])
                     return False
 
                 self.keyid = int(data)
 
                 if self.keyid < 0 or self.keyid > 4:
-                    self.connection.send(MESSAGES["SERVER_KEY_OUT_OF_RANGE_ERROR"])
+                    self.outbox.append(MESSAGES["SERVER_KEY_OUT_OF_RANGE_ERROR"])
                     return False
                 
-                self.calculate_hash()
-
-                server_hash = self.hash + SERVER_KEY[self.keyid]
-                server_hash %= 65536
-                confirmation_message = f"{server_hash}\a\b"
+                (self.hash, confirmation_message) = self.confirmation(self.username, self.keyid)
 
                 self.phase = self.AuthenticationPhase.CONFIRMATION
-                self.connection.send(confirmation_message.encode("ascii"))
+                self.outbox.append(confirmation_message)
                 return True
 
             elif self.phase == self.AuthenticationPhase.CONFIRMATION:
                 if not data.isdecimal():
-                    self.connection.send(MESSAGES["SERVER_SYNTAX_ERROR"])
+                    self.outbox.append(MESSAGES["SERVER_SYNTAX_ERROR"])
                     return False
                 
                 clientkey = int(data)
@@ -167,21 +1997,39 @@ class ServerThread(threading.Thread):
                     clientkey = 65536 + clientkey
 
                 if clientkey != self.hash:
-                    self.connection.send(MESSAGES["SERVER_LOGIN_FAILED"])
+                    self.outbox.append(MESSAGES["SERVER_LOGIN_FAILED"])
                     return False
 
                 self.phase = self.AuthenticationPhase.AUTHENTICATED
-                self.connection.send(MESSAGES["SERVER_OK"])
-                self.connection.send(MESSAGES["SERVER_TURN_LEFT"])
+                self.outbox.append(MESSAGES["SERVER_OK"])
+                if self.tickets is not None:
+                    self.issue_ticket()
+                self.outbox.append(MESSAGES["SERVER_TURN_LEFT"])
                 return True     
 
     ## Class for processing client movement
     #
     class Movement():
 
-        ## Defines direction of robot movement
+        __slots__ = ("outbox", "x", "y", "direction", "picking_up_message", "recharging", "last_moved", "first_move",
+                     "unstuck_moves_left", "obstacles", "visited", "unknown_bumps", "turns", "speculating", "expected",
+                     "moves", "obstacle_hits")
+
+        ## If true, next move is planned by searching grid with obstacles found so far, else simple strategy is used
+        #
+        planning = False
+
+        ## Obstacle map shared by all sessions (ObstacleMap) or None
+        #
+        obstacle_map = None
+
+        ## Maximum number of commands sent at once without waiting for reply when planning, 1 disables pipelining
+        #
+        pipeline_depth = 1
+
+        ## Defines direction of robot movement as small int codes
         #
-        class Direction(enum.Enum):
+        class Direction(enum.IntEnum):
             POSITIVE_X = 0
             POSITIVE_Y = 1
             NEGATIVE_X = 2
@@ -190,10 +2038,10 @@ class ServerThread(threading.Thread):
         ## Constructor
         #
         #  @param self
-        #  @param connection Connection to client
+        #  @param outbox List collecting frames to be sent to client
         #
-        def __init__(self, connection) -> None:
-            self.connection = connection
+        def __init__(self, outbox) -> None:
+            self.outbox = outbox
             self.x = None
             self.y = None
             self.direction = None
@@ -202,19 +2050,64 @@ class ServerThread(threading.Thread):
             self.last_moved = False
             self.first_move = True
             self.unstuck_moves_left = 0
+            # Created once the first obstacle, visited cell or bump is recorded, simple strategy never records visited cells
+            self.obstacles = None
+            self.visited = None
+            self.unknown_bumps = None
+            self.turns = 0
+            self.speculating = self.pipeline_depth > 1
+            self.expected = collections.deque() if self.speculating else None
+            self.moves = 0
+            self.obstacle_hits = 0
+
+        ## Check if direction is known regardless of reply to the last command
+        #
+        #  That is the case only if the last unanswered command was a single move, which does not change direction.
+        #
+        #  @param self
+        #
+        #  @returns bool Direction is known
+        #
+        def direction_kept(self) -> bool:
+            return self.direction is not None and self.last_moved and self.unstuck_moves_left <= 0 and not self.expected
+
+        ## Continue movement of resumed session with new outbox
+        #
+        #  Direction is kept only if it is still known (see direction_kept).
+        #  Robot turns left like after login and reports its position, obstacles restored from ticket are kept.
+        #  Moves and obstacle hits are counted from zero again, so metrics observe only those of the new connection.
+        #
+        #  @param self
+        #  @param outbox List collecting frames to be sent to client
+        #
+        def resume(self, outbox):
+            self.outbox = outbox
+            if not self.direction_kept():
+                self.direction = None
+                self.unknown_bumps = None
+            if self.expected:
+                self.expected.clear()
+            self.first_move = True
+            self.last_moved = False
+            self.unstuck_moves_left = 0
+            self.picking_up_message = False
+            self.moves = 0
+            self.obstacle_hits = 0
+            self.rotate(True)
 
-        ## Sends message requesting client to move
+        ## Queues message requesting client to move
         #
         #  @param self
         #
         def move(self):
             global MESSAGES
-            self.connection.send(MESSAGES["SERVER_MOVE"])
+            self.outbox.append(MESSAGES["SERVER_MOVE"])
             self.last_moved = True
+            self.moves += 1
 
-        ## Sends message requesting client to rotate
+        ## Queues message requesting client to rotate
         #
-        #  Calculates new direction the robot will be facing and sends request
+        #  Calculates new direction the robot will be facing and queues request
         #
         #  @param self
         #  @param left If true, rotate anticlockwise, else rotate clockwise
@@ -223,16 +2116,19 @@ class ServerThread(threading.Thread):
             global MESSAGES
             rotation_value = None
             if left:
-                if self.direction:
+                if self.direction is not None:
                     rotation_value = (self.direction.value + 1) % 4
-                self.connection.send(MESSAGES["SERVER_TURN_LEFT"])
+                self.outbox.append(MESSAGES["SERVER_TURN_LEFT"])
+                self.turns += 1
             else:
-                if self.direction:
+                if self.direction is not None:
                     rotation_value = (self.direction.value - 1) % 4
-                self.connection.send(MESSAGES["SERVER_TURN_RIGHT"])
-            if self.direction:
+                self.outbox.append(MESSAGES["SERVER_TURN_RIGHT"])
+                self.turns -= 1
+            if self.direction is not None:
                 self.direction = self.Direction(rotation_value)
             self.last_moved = False
+            self.moves += 1
 
         ## Calculates if next request should be rotation or movement
         #
@@ -242,7 +2138,7 @@ class ServerThread(threading.Thread):
         #  If facing requested direction of movement, move, else rotate whichever way is closer.
         #
         def calculate_direction(self, direction):
-            if not self.direction or self.direction == direction:
+            if self.direction is None or self.direction == direction:
                 self.move()
             else:
                 if (direction.value - self.direction.value) == -1 or (direction.value - self.direction.value) == 3:
@@ -260,7 +2156,7 @@ class ServerThread(threading.Thread):
             left = True
 
             # Calculate which side of obstacle to move to
-            if self.direction:
+            if self.direction is not None:
                 if self.x > 0:
                     if self.y < 0:
                         left = False
@@ -284,40 +2180,315 @@ class ServerThread(threading.Thread):
         def get_message(self):
             global MESSAGES
             self.picking_up_message = True
-            self.connection.send(MESSAGES["SERVER_PICK_UP"])
+            self.outbox.append(MESSAGES["SERVER_PICK_UP"])
 
         ## Calculates next move to zero coords based on current coords
         #
         #  @param self
         #
-        def calculate_move(self):
-            if self.x != 0:
-                if self.x > 0:
-                    self.calculate_direction(self.Direction.NEGATIVE_X)
-                elif self.x < 0:
-                    self.calculate_direction(self.Direction.POSITIVE_X)
-            elif self.y != 0:
-                if self.y > 0:
-                    self.calculate_direction(self.Direction.NEGATIVE_Y)
-                elif self.y < 0:
-                    self.calculate_direction(self.Direction.POSITIVE_Y)
-            else:
-                self.last_moved = False
-                self.get_message()
+        def calculate_move(self):
+            if self.x != 0:
+                if self.x > 0:
+                    self.calculate_direction(self.Direction.NEGATIVE_X)
+                elif self.x < 0:
+                    self.calculate_direction(self.Direction.POSITIVE_X)
+            elif self.y != 0:
+                if self.y > 0:
+                    self.calculate_direction(self.Direction.NEGATIVE_Y)
+                elif self.y < 0:
+                    self.calculate_direction(self.Direction.POSITIVE_Y)
+            else:
+                self.last_moved = False
+                self.get_message()
+
+        ## Offsets of coordinates after moving in each direction (indexed by direction value)
+        #
+        STEPS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+        ## Record obstacle in session and in shared obstacle map
+        #
+        #  @param self
+        #  @param x Coordinate x of obstacle
+        #  @param y Coordinate y of obstacle
+        #
+        def record_obstacle(self, x, y):
+            if self.obstacles is None:
+                self.obstacles = set()
+            self.obstacles.add((x, y))
+            if self.obstacle_map is not None:
+                self.obstacle_map.add(x, y)
+
+        ## Check if cell is known obstacle, found by this or any other session
+        #
+        #  @param self
+        #  @param x Coordinate x
+        #  @param y Coordinate y
+        #
+        #  @returns bool Cell is obstacle
+        #
+        def blocked(self, x, y) -> bool:
+            if self.obstacles is not None and (x, y) in self.obstacles:
+                return True
+            return self.obstacle_map is not None and self.obstacle_map.contains(x, y)
+
+        ## Record cell the robot stands on as clear
+        #
+        #  @param self
+        #  @param x Coordinate x
+        #  @param y Coordinate y
+        #
+        def record_clear(self, x, y):
+            if self.visited is None:
+                self.visited = set()
+            if (x, y) not in self.visited:
+                self.visited.add((x, y))
+                if self.obstacle_map is not None:
+                    self.obstacle_map.add_clear(x, y)
+
+        ## Check if cell is known to be clear, found by this or any other session
+        #
+        #  @param self
+        #  @param x Coordinate x
+        #  @param y Coordinate y
+        #
+        #  @returns bool Cell is clear
+        #
+        def clear(self, x, y) -> bool:
+            if self.visited is not None and (x, y) in self.visited:
+                return True
+            return self.obstacle_map is not None and self.obstacle_map.contains_clear(x, y)
+
+        ## Record obstacle the robot has just bumped into
+        #
+        #  If direction is not known yet, the bump is remembered and obstacle is recorded once direction is found out.
+        #
+        #  @param self
+        #
+        def obstacle_hit(self):
+            self.obstacle_hits += 1
+            if self.direction is not None:
+                step = self.STEPS[self.direction.value]
+                self.record_obstacle(self.x + step[0], self.y + step[1])
+            else:
+                if self.unknown_bumps is None:
+                    self.unknown_bumps = []
+                self.unknown_bumps.append((self.x, self.y, self.turns))
+
+        ## Record obstacles bumped into before direction was known
+        #
+        #  Direction at the time of bump is derived from current direction and turns made since then.
+        #
+        #  @param self
+        #
+        def resolve_bumps(self):
+            if self.unknown_bumps is None:
+                return
+            for (x, y, turns) in self.unknown_bumps:
+                step = self.STEPS[(self.direction.value - (self.turns - turns)) % 4]
+                self.record_obstacle(x + step[0], y + step[1])
+            self.unknown_bumps = None
+
+        ## Estimate lower bound of commands needed to reach zero coords
+        #
+        #  Manhattan distance plus turns needed to face every direction the robot has to move in.
+        #
+        #  @param x Coordinate x
+        #  @param y Coordinate y
+        #  @param direction Direction value
+        #
+        #  @returns int Number of commands
+        #
+        @staticmethod
+        def estimate(x, y, direction) -> int:
+            needed = []
+            if x != 0:
+                needed.append(2 if x > 0 else 0)
+            if y != 0:
+                needed.append(3 if y > 0 else 1)
+            if not needed or direction in needed:
+                turns = len(needed) - 1 if needed else 0
+            else:
+                turns = min(min((target - direction) % 4, (direction - target) % 4) for target in needed) + len(needed) - 1
+            return abs(x) + abs(y) + turns
+
+        ## Search for shortest sequence of commands leading to zero coords (A*)
+        #
+        #  Every command (move or turn) costs one round trip. Known obstacles (also those found by other sessions) are avoided, unknown cells are expected to be free.
+        #  Search is limited to rectangle around robot, zero coords and obstacles found in this session.
+        #
+        #  @param self
+        #
+        #  @returns list|None Commands ("MOVE", "LEFT", "RIGHT") or None if there is no path
+        #
+        def search(self):
+            obstacles = self.obstacles or ()
+            xs = [self.x, 0] + [obstacle[0] for obstacle in obstacles]
+            ys = [self.y, 0] + [obstacle[1] for obstacle in obstacles]
+            (min_x, max_x, min_y, max_y) = (min(xs) - 3, max(xs) + 3, min(ys) - 3, max(ys) + 3)
+
+            start = (self.x, self.y, self.direction.value)
+            previous = {start: None}
+            costs = {start: 0}
+            queue = [(self.estimate(*start), 0, start)]
+            while queue:
+                (_, cost, state) = heapq.heappop(queue)
+                (x, y, direction) = state
+                if x == 0 and y == 0:
+                    commands = []
+                    while previous[state] is not None:
+                        (state, command) = previous[state]
+                        commands.append(command)
+                    commands.reverse()
+                    return commands
+                if cost > costs[state]:
+                    continue
+
+                step = self.STEPS[direction]
+                successors = [((x, y, (direction + 1) % 4), "LEFT"), ((x, y, (direction - 1) % 4), "RIGHT")]
+                (next_x, next_y) = (x + step[0], y + step[1])
+                if min_x <= next_x <= max_x and min_y <= next_y <= max_y and not self.blocked(next_x, next_y):
+                    successors.append(((next_x, next_y, direction), "MOVE"))
+
+                for (successor, command) in successors:
+                    if cost + 1 < costs.get(successor, cost + 2):
+                        costs[successor] = cost + 1
+                        previous[successor] = (state, command)
+                        heapq.heappush(queue, (cost + 1 + self.estimate(*successor), cost + 1, successor))
+            return None
+
+        ## Calculates next move to zero coords avoiding all obstacles found so far
+        #
+        #  @param self
+        #
+        def plan_move(self):
+            if self.x == 0 and self.y == 0:
+                self.last_moved = False
+                self.get_message()
+                return
+
+            # Direction is found out by moving, turn first if the robot could not move
+            if self.direction is None:
+                if self.last_moved and self.unknown_bumps:
+                    self.rotate(True)
+                else:
+                    self.move()
+                return
+
+            commands = self.search()
+            if not commands:
+                self.calculate_move()
+            elif self.speculating:
+                self.send_pipelined(commands)
+            elif commands[0] == "MOVE":
+                self.move()
+            else:
+                self.rotate(commands[0] == "LEFT")
+
+        ## Queue several planned commands at once, while path ahead is known to be clear
+        #
+        #  Commands are sent up to pipeline depth and up to the first move into cell not known to be clear (included, nothing depends on its result).
+        #  Position expected after every command is remembered to reconcile replies with.
+        #
+        #  @param self
+        #  @param commands Planned commands ("MOVE", "LEFT", "RIGHT")
+        #
+        def send_pipelined(self, commands):
+            (x, y) = (self.x, self.y)
+            for command in commands[:self.pipeline_depth]:
+                direction = self.direction.value
+                if command == "MOVE":
+                    self.move()
+                    step = self.STEPS[direction]
+                    (x, y) = (x + step[0], y + step[1])
+                else:
+                    self.rotate(command == "LEFT")
+                self.expected.append((command == "MOVE", direction, x, y))
+                if command == "MOVE" and not self.clear(x, y):
+                    break
+
+        ## Reconcile reply with the oldest pipelined command
+        #
+        #  Bumps are recorded as obstacles. If position differs from expected, pipelining is stopped for the rest of session,
+        #  replies to remaining commands are only reconciled and step by step planning continues after the last of them.
+        #
+        #  @param self
+        #  @param new_x Reported coordinate x
+        #  @param new_y Reported coordinate y
+        #
+        #  @returns bool If false, robot has not made the requested command (logic error queued) and connection should be terminated
+        #
+        def reconcile(self, new_x, new_y) -> bool:
+            (moved, direction, expected_x, expected_y) = self.expected.popleft()
+            # Robot either stays or makes the single step it was asked for
+            step = self.STEPS[direction] if moved else (0, 0)
+            if (new_x != self.x or new_y != self.y) and (new_x != self.x + step[0] or new_y != self.y + step[1]):
+                self.outbox.append(MESSAGES["SERVER_LOGIC_ERROR"])
+                return False
+            if moved and new_x == self.x and new_y == self.y:
+                self.obstacle_hits += 1
+                step = self.STEPS[direction]
+                self.record_obstacle(self.x + step[0], self.y + step[1])
+            if new_x != expected_x or new_y != expected_y:
+                self.speculating = False
+
+            self.x = new_x
+            self.y = new_y
+            self.record_clear(new_x, new_y)
+            if not self.expected:
+                self.plan_move()
+            return True
+
+        ## Process reported position when planning is enabled
+        #
+        #  @param self
+        #  @param new_x Reported coordinate x
+        #  @param new_y Reported coordinate y
+        #
+        #  @returns bool If false, robot has not made the requested move (logic error queued) and connection should be terminated
+        #
+        def follow_plan(self, new_x, new_y) -> bool:
+            global MESSAGES
+            if self.expected:
+                return self.reconcile(new_x, new_y)
+
+            if self.first_move:
+                self.first_move = False
+            elif new_x != self.x or new_y != self.y:
+                # Only a move can change position and only by a single step
+                if not self.last_moved or abs(new_x - self.x) + abs(new_y - self.y) != 1:
+                    self.outbox.append(MESSAGES["SERVER_LOGIC_ERROR"])
+                    return False
+                if new_x > self.x:
+                    self.direction = self.Direction.POSITIVE_X
+                elif new_x < self.x:
+                    self.direction = self.Direction.NEGATIVE_X
+                elif new_y > self.y:
+                    self.direction = self.Direction.POSITIVE_Y
+                else:
+                    self.direction = self.Direction.NEGATIVE_Y
+                self.resolve_bumps()
+            elif self.last_moved:
+                self.obstacle_hit()
+
+            self.x = new_x
+            self.y = new_y
+            self.record_clear(new_x, new_y)
+            self.plan_move()
+            return True
 
         ## Check if message length is valid before processing it
         #
         #  Calculates whether the message fits the expected length.
         #
         #  @param self
-        #  @param data Received message
+        #  @param data Received message (bytes-like, not decoded)
         #  
         #  @returns bool Valid length
         #
         def verify_length(self, data):
             # Check if contains part of message separation characters
             prefix_size = 0
-            if len(data) != 0 and data[-1] == "\a":
+            if data[-1:] == b"\a":
                 prefix_size += 1
 
             # Check if message length is expected
@@ -345,32 +2516,31 @@ class ServerThread(threading.Thread):
         ## Process received movement message
         #
         #  @param self
-        #  @param data Received message
+        #  @param data Received message with already verified length
         #
         #  @returns bool If true movement is valid, else should terminate connection (or goal has been achieved and should terminate)
         def process_message(self, data) -> bool:
             global MESSAGES
 
-            # Check for correct length
-            if not self.verify_length(data):
-                self.connection.send(MESSAGES["SERVER_SYNTAX_ERROR"])
-                return False
-
             # Perform action based on received message
             if "OK" in data and not self.picking_up_message:
 
                 data_split = data.split(" ")
 
                 # Check for correct syntax
-                if data_split[0] != "OK" or not self.verify_digit(data_split[1]) or not self.verify_digit(data_split[2]) or len(data_split) != 3:
-                    self.connection.send(MESSAGES["SERVER_SYNTAX_ERROR"])
+                if len(data_split) != 3 or data_split[0] != "OK" or not self.verify_digit(data_split[1]) or not self.verify_digit(data_split[2]):
+                    self.outbox.append(MESSAGES["SERVER_SYNTAX_ERROR"])
                     return False
                 new_x = int(data_split[1])
                 new_y = int(data_split[2])
 
+                if self.planning:
+                    return self.follow_plan(new_x, new_y)
+
                 # Based on current and last position verify if stuck and calculate direction  
                 if not self.first_move:
                     if (self.last_moved and (new_x == self.x and new_y == self.y)) and self.unstuck_moves_left <= 0:
+                        self.obstacle_hit()
                         self.unstuck()
 
                     if (new_x > self.x):
@@ -388,7 +2558,10 @@ class ServerThread(threading.Thread):
                 # Check if first move or processing stuck mechanism messages or if client robot is in final destination and move accordingly
                 if self.first_move:
                     self.first_move = False
-                    if self.x == 0 and self.y == 0:
+                    if self.direction is not None:
+                        # Resumed session
+                        self.calculate_move()
+                    elif self.x == 0 and self.y == 0:
                         self.get_message()
                     else:
                         self.move()
@@ -399,78 +2572,193 @@ class ServerThread(threading.Thread):
                         self.unstuck_moves_left -= 1
             else:
                 if self.picking_up_message:
-                    self.connection.send(MESSAGES["SERVER_LOGOUT"])
+                    self.outbox.append(MESSAGES["SERVER_LOGOUT"])
                     return False
 
-                self.connection.send(MESSAGES["SERVER_SYNTAX_ERROR"])
+                self.outbox.append(MESSAGES["SERVER_SYNTAX_ERROR"])
                 return False
             return True
 
     ## Constructor
     #
     #  @param self
-    #  @param connection Connection to client
     #  @param address Tuple of IPv4 address and port of connected client
     #
-    def __init__(self, connection, address) -> None:
-        threading.Thread.__init__(self)
-        self.connection = connection
+    def __init__(self, address) -> None:
+        self.id = next(Session.ids)
         self.address = address
-        self.data = ""
-        self.authentication = ServerThread.Authentication(connection)
-        self.movement = ServerThread.Movement(connection)
+        self.framer = Framer(RECV_SIZE + MESSAGE_MAX_LENGTH)
+        self.validator = Validator()
+        self.outbox = []
+        self.authentication = Session.Authentication(self.outbox)
+        self.movement = Session.Movement(self.outbox)
         self.active = True
         self.recharging = False
+        self.timeout = TIMEOUT
+        self.started = time.perf_counter()
+        self.end_reason = None
+        self.finished = False
+        self.received_bytes = 0
+
+        # CPU time and number of calls of every accounted part, None when accounting is disabled
+        self.usage = None
+        if Session.accounting:
+            self.usage = [0.0, 0] * len(Session.PARTS)
+            Session.live[self.id] = self
+
+        METRIC_SESSIONS_ACTIVE.inc()
+        METRIC_SESSIONS_PHASE.inc(1, self.authentication.phase.name)
+
+        LOGGER.log("connected", session=self)
+        if self.capture is not None:
+            self.capture.record(self, Capture.OPEN, (address[0] + ":" + str(address[1])).encode("ascii"))
+
+    ## Record end of session
+    #
+    #  Called by transport when connection is terminated, only the first call has effect.
+    #
+    #  @param self
+    #  @param reason Reason of end used if protocol itself has not ended session (timeout, closed, error)
+    #
+    def finish(self, reason):
+        if self.finished:
+            return
+        self.finished = True
+        self.active = False
+        if self.usage is not None:
+            Session.live.pop(self.id, None)
+        if self.end_reason is None:
+            self.end_reason = reason
+
+        METRIC_SESSIONS_ACTIVE.dec()
+        METRIC_SESSIONS_PHASE.dec(1, self.authentication.phase.name)
+        METRIC_SESSIONS_ENDED.inc(1, self.end_reason)
+        LOGGER.log(self.end_reason, session=self)
+        if self.capture is not None:
+            self.capture.record(self, Capture.CLOSE, self.end_reason.encode("ascii"))
+        if self.authentication.phase == self.authentication.AuthenticationPhase.AUTHENTICATED:
+            METRIC_MOVES.observe(self.movement.moves)
+            METRIC_OBSTACLE_HITS.observe(self.movement.obstacle_hits)
+            if self.authentication.ticket is not None and self.end_reason in ResumptionTickets.REASONS:
+                self.authentication.tickets.store(self.authentication.ticket, self.movement)
+
+    ## Record unexpected exception raised while serving session
+    #
+    #  Session is not active anymore and transport ends it with reason error. Its movement cannot be resumed, as its state may be inconsistent.
+    #
+    #  @param self
+    #  @param error Raised exception
+    #
+    def fail(self, error):
+        self.active = False
+        self.authentication.ticket = None
+        LOGGER.log("session_failed", "error", session=self, message=type(error).__name__ + ": " + str(error))
 
-        self.connection.settimeout(1) #Sets default timeout
+    ## Add CPU time spent by this thread since given time to accounted part
+    #
+    #  @param self
+    #  @param part Index of accounted part
+    #  @param started Thread CPU time (time.thread_time) when the part started
+    #
+    def account(self, part, started):
+        self.usage[2 * part] += time.thread_time() - started
+        self.usage[2 * part + 1] += 1
 
-        print("OK: Connected from " + address[0] + ":" + str(address[1]))
+    ## Get accounted usage of session
+    #
+    #  @param self
+    #
+    #  @returns dict Session id, address, phase, age and CPU time in ms with number of calls of every part
+    #
+    def report_usage(self) -> dict:
+        return {
+            "session": self.id,
+            "address": self.address[0] + ":" + str(self.address[1]),
+            "phase": self.authentication.phase.name,
+            "age_s": round(time.perf_counter() - self.started, 3),
+            "cpu_ms": round(self.usage[2 * Session.RUN] * 1000, 3),
+            "parts": {part: {"cpu_ms": round(self.usage[2 * index] * 1000, 3), "calls": self.usage[2 * index + 1]}
+                      for (index, part) in enumerate(Session.PARTS)}
+        }
+
+    ## Get live sessions which spent the most CPU time
+    #
+    #  @param count Number of sessions
+    #
+    #  @returns list Usage reports (see report_usage)
+    #
+    @staticmethod
+    def top(count) -> list:
+        sessions = list(Session.live.values())
+        sessions = heapq.nlargest(count, sessions, key=lambda session: session.usage[2 * Session.RUN])
+        return [session.report_usage() for session in sessions]
 
-    ## Shortcut for sending sytax error message
+    ## Shortcut for queueing sytax error message
     #
     def syntax_error(self):
         global MESSAGES
-        self.connection.send(MESSAGES["SERVER_SYNTAX_ERROR"])
+        self.outbox.append(MESSAGES["SERVER_SYNTAX_ERROR"])
         self.active = False
 
-    ## Shortcut for sending sytax logic message
+    ## Shortcut for queueing sytax logic message
     #
     def logical_error(self):
         global MESSAGES
-        self.connection.send(MESSAGES["SERVER_LOGIC_ERROR"])
+        self.outbox.append(MESSAGES["SERVER_LOGIC_ERROR"])
         self.active = False
 
     ## Process recharge message
     # 
     #  Handle recharging (client halting).
     #  If already recharging set timeout to default, else set timeout to specified value.
+    #  Timeout is only stored, it is up to the transport serving the session to apply it.
     # 
     #  @param self
     #
     def recharge(self):
         if not self.recharging:
-            self.connection.settimeout(5)
+            self.timeout = TIMEOUT_RECHARGING
             self.recharging = True
+            METRIC_RECHARGES.inc()
         else:
-            self.connection.settimeout(1)
+            self.timeout = TIMEOUT
             self.recharging = False
 
+    ## Check if message length is valid before processing it
+    #
+    #  Uses length limits of authentication or movement based on current status of authentication.
+    #
+    #  @param self
+    #  @param data Received message or its unfinished part (bytes-like, not decoded)
+    #
+    #  @returns bool Valid length
+    #
+    def verify_length(self, data) -> bool:
+        if (self.authentication.phase != self.authentication.AuthenticationPhase.AUTHENTICATED) and not self.recharging:
+            return self.authentication.verify_length(data)
+        return self.movement.verify_length(data)
+
     ## Extract and process messages in recieved data
     #
-    #  Looks for separation characters in data and extracts message before these characters.
-    #  First tries to process recharging (halting) message, if not halted sends recieved message to authentication or movement handler in corresponding class based on current status of authentication.
+    #  Extracts complete messages from framer.
+    #  First tries to process recharging (halting) message, if not halted verifies message length, decodes message and sends it to authentication or movement handler in corresponding class based on current status of authentication.
     #  
     #  @param self
     #
     #  @returns bool If failed and needs to terminate connection false, else true.
     def handle_data(self) -> bool:
-        while '\a\b' in self.data:
-            new_partition = self.data.partition("\a\b")
-            new_string = new_partition[0]
-            self.data = new_partition[2]
+        usage = self.usage
+        if usage is not None:
+            handle_started = time.thread_time()
+        extracted = False
+        while True:
+            message = self.framer.next_message()
+            if message is None:
+                break
+            extracted = True
 
             # Recharging handling
-            if new_string == "RECHARGING":
+            if message == b"RECHARGING":
                 if self.recharging:
                     self.logical_error()
                     return False
@@ -478,114 +2766,1049 @@ class ServerThread(threading.Thread):
                 continue
             else:
                 if self.recharging:
-                    if new_string == "FULL POWER":
+                    if message == b"FULL POWER":
                         self.recharge()
                         continue
                     else:
                         self.logical_error()
                         return False
 
+            # Check for correct length
+            if not self.verify_length(message):
+                self.syntax_error()
+                return False
+
+            try:
+                new_string = str(message, "ascii")
+            except UnicodeDecodeError:
+                self.active = False
+                return False
+
             # Authentication and movement handling
-            if (self.authentication.phase != self.authentication.AuthenticationPhase.AUTHENTICATED):
-                if not self.authentication.authenticate(new_string):
-                    self.active = False
-                    return False
+            started = time.perf_counter()
+            if usage is not None:
+                part_started = time.thread_time()
+            phase = self.authentication.phase
+            if (phase != self.authentication.AuthenticationPhase.AUTHENTICATED):
+                valid = self.authentication.authenticate(new_string)
+                if self.authentication.phase != phase:
+                    METRIC_SESSIONS_PHASE.dec(1, phase.name)
+                    METRIC_SESSIONS_PHASE.inc(1, self.authentication.phase.name)
+                    if self.authentication.phase == self.authentication.AuthenticationPhase.AUTHENTICATED:
+                        METRIC_HANDSHAKE.observe(time.perf_counter() - self.started)
+                        if self.authentication.resumed is not None:
+                            self.movement = self.authentication.resumed
+                            self.authentication.resumed = None
+                            self.movement.resume(self.outbox)
+                            METRIC_SESSIONS_RESUMED.inc()
+                            LOGGER.log("resumed", session=self)
+                        else:
+                            LOGGER.log("authenticated", session=self)
             else:
-                if not self.movement.process_message(new_string):
-                    self.active = False
-                    return False
+                valid = self.movement.process_message(new_string)
+            METRIC_PROCESSING.observe(time.perf_counter() - started)
+            if usage is not None:
+                self.account(Session.AUTHENTICATION if phase != self.authentication.AuthenticationPhase.AUTHENTICATED else Session.MOVEMENT, part_started)
+
+            if not valid:
+                self.active = False
+                return False
+
+        # Unfinished message is now validated according to current state of session
+        if extracted:
+            self.validator.reset(self.validation_kind())
+        if usage is not None:
+            self.account(Session.HANDLE_DATA, handle_started)
         return True
 
+    ## Get kind of message expected next, used by validator
+    #
+    #  @param self
+    #
+    #  @returns int Kind of message as defined in Validator
+    #
+    def validation_kind(self) -> int:
+        if self.recharging:
+            return Validator.MESSAGE if self.movement.picking_up_message else Validator.RECHARGING
+        phase = self.authentication.phase
+        if phase == self.authentication.AuthenticationPhase.USERNAME:
+            return Validator.USERNAME
+        elif phase == self.authentication.AuthenticationPhase.KEY_ID:
+            return Validator.KEY_ID
+        elif phase == self.authentication.AuthenticationPhase.CONFIRMATION:
+            return Validator.CONFIRMATION
+        return Validator.MESSAGE if self.movement.picking_up_message else Validator.POSITION
+
+    ## Get buffer to receive data from client into
+    #
+    #  @param self
+    #
+    #  @returns memoryview Writable buffer, data written to it are then processed by received
+    #
+    def receive_buffer(self) -> memoryview:
+        return self.framer.writable()
+
+    ## Process bytes received from client into receive buffer
+    #
+    #  Entry point of protocol core used by transports.
+    #  All frames produced while processing the data are returned together, so transport can send them in one call.
+    #  If session is not active afterwards, transport should send returned frames and terminate connection.
+    #
+    #  If unfinished message is longer than specified limit or has invalid syntax, optimizes by ending session.
+    #
+    #  @param self
+    #  @param size Number of bytes written into receive buffer
+    #
+    #  @returns list Frames (bytes) to send to client in order
+    def received(self, size) -> list:
+        self.framer.written(size)
+        METRIC_BYTES_RECEIVED.inc(size)
+        if self.capture is not None:
+            self.capture.record(self, Capture.INBOUND, self.framer.view[self.framer.end - size:self.framer.end])
+
+        # Client which exceeded budget of session is disconnected without reply
+        self.received_bytes += size
+        if self.over_budget():
+            self.active = False
+            self.end_reason = "over_budget"
+            self.framer.release()
+            return []
+
+        # Handle data
+        if not self.handle_data():
+            self.active = False
+
+        ## Message length and syntax checking optimalization
+        elif not self.validator.feed(self.framer.pending()):
+            self.syntax_error()
+
+        frames = self.outbox[:]
+        self.outbox.clear()
+
+        # Idle session does not hold receive buffer
+        self.framer.release()
+
+        if frames:
+            METRIC_BYTES_SENT.inc(sum(len(frame) for frame in frames))
+            if self.capture is not None:
+                self.capture.record(self, Capture.OUTBOUND, b"".join(frames))
+        if not self.active and self.end_reason is None:
+            self.end_reason = END_REASONS.get(frames[-1], "invalid_data") if frames else "invalid_data"
+        return frames
+
+    ## Check if session exceeded its duration or number of received bytes
+    #
+    #  @param self
+    #
+    #  @returns bool Budget of session is exceeded
+    #
+    def over_budget(self) -> bool:
+        if self.byte_budget is not None and self.received_bytes > self.byte_budget:
+            return True
+        return self.time_budget is not None and time.perf_counter() - self.started > self.time_budget
+
+    ## Process bytes received from client
+    #
+    #  Same as received, for transports which do not receive directly into receive buffer.
+    #
+    #  @param self
+    #  @param data Received bytes
+    #
+    #  @returns list Frames (bytes) to send to client in order
+    def receive(self, data) -> list:
+        frames = []
+        offset = 0
+        while offset < len(data) and self.active:
+            buffer = self.receive_buffer()
+            size = min(len(buffer), len(data) - offset)
+            buffer[:size] = data[offset:offset + size]
+            offset += size
+            frames += self.received(size)
+        return frames
+
+
+## Class serving one session in its own thread with blocking socket
+#
+class ServerThread(Session, threading.Thread):
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param connection Connection to client
+    #  @param address Tuple of IPv4 address and port of connected client
+    #
+    def __init__(self, connection, address) -> None:
+        threading.Thread.__init__(self)
+        Session.__init__(self, address)
+        self.connection = connection
+        self.writes = WriteQueue()
+
+        self.connection.settimeout(self.timeout) #Sets default timeout
+
     ## Primary function of thread
     #
     #  Receives data from connection and calls handler to process it.
     #
-    #  If data is longer than specified limit and still not processed, optimizes by cutting connection.
     def run(self):
-        while self.active:
-            # Receive data
+        timeout = self.timeout
+        reason = "error"
+        try:
+            while self.active:
+                # Blocking in receive does not use CPU time, whole iteration can be accounted
+                if self.usage is not None:
+                    started = time.thread_time()
+
+                # Apply timeout changed by recharging
+                if timeout != self.timeout:
+                    timeout = self.timeout
+                    self.connection.settimeout(timeout)
+
+                # Receive data
+                try:
+                    received = self.connection.recv_into(self.receive_buffer(), RECV_SIZE)
+                except socket.timeout:
+                    reason = "timeout"
+                    break
+                except OSError:
+                    break
+
+                # Client closed connection
+                if not received:
+                    reason = "closed"
+                    break
+                if TUNING.quickack:
+                    TUNING.received(self.connection)
+
+                # Send all responses at once, blocking at most for timeout of session
+                frames = self.received(received)
+                if frames:
+                    self.writes.push(frames)
+                    try:
+                        self.writes.flush(self.connection)
+                    except socket.timeout:
+                        reason = "slow_reader"
+                        break
+                    except OSError:
+                        break
+
+                if self.usage is not None:
+                    self.account(Session.RUN, started)
+        except Exception as error:
+            self.fail(error)
+        finally:
             try:
-                self.data += self.connection.recv(1024).decode("ascii")
-            except:
-                self.active = False
+                self.finish(reason)
+            finally:
                 self.connection.close()
+                SLOTS.release()
 
-            # Handle data
-            if not self.handle_data():
-                self.connection.close()
 
-            ## Message length checking optimalization
-            if (self.authentication.phase != self.authentication.AuthenticationPhase.AUTHENTICATED) and not self.recharging:
-                if not self.authentication.verify_length(self.data):
-                    self.syntax_error()
-                    self.connection.close()
-            else:
-                if not self.movement.verify_length(self.data):
-                    self.syntax_error()
-                    self.connection.close()
+## Class serving one session as coroutine on asyncio event loop
+#
+class AsyncServerSession(Session):
+
+    __slots__ = ("reader", "writer")
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param reader Asyncio stream reader of connection to client
+    #  @param writer Asyncio stream writer of connection to client
+    #
+    def __init__(self, reader, writer) -> None:
+        Session.__init__(self, writer.get_extra_info("peername"))
+        self.reader = reader
+        self.writer = writer
+        self.writer.transport.set_write_buffer_limits(high=WriteQueue.high_water)
+
+    ## Primary coroutine of session
+    #
+    #  Receives data from connection and calls handler to process it.
+    #  Waiting for data is limited by timeout of session, same as in ServerThread.
+    #
+    async def run(self):
+        reason = "error"
+        try:
+            while self.active:
+                # Receive data
+                try:
+                    received = await asyncio.wait_for(self.reader.read(RECV_SIZE), self.timeout)
+                except asyncio.TimeoutError:
+                    reason = "timeout"
+                    break
+                except OSError:
+                    break
+
+                # Client closed connection
+                if not received:
+                    reason = "closed"
+                    break
+                if TUNING.quickack:
+                    TUNING.received(self.writer.get_extra_info("socket"))
+
+                # Other coroutines run while waiting, only processing of received data is accounted
+                if self.usage is not None:
+                    started = time.thread_time()
+
+                # Send all responses at once, wait for client to read them if it reads slower than it sends
+                frames = self.receive(received)
+                if frames:
+                    # Transport sends all frames at once, or buffers them when socket is not writable
+                    self.writer.writelines(frames)
+                    METRIC_SEND_CALLS.inc()
+                    if self.writer.transport.get_write_buffer_size() > WriteQueue.high_water:
+                        try:
+                            await asyncio.wait_for(self.writer.drain(), self.timeout)
+                        except asyncio.TimeoutError:
+                            reason = "slow_reader"
+                            break
+                        except OSError:
+                            break
+
+                if self.usage is not None:
+                    self.account(Session.RUN, started)
+        except Exception as error:
+            self.fail(error)
+        finally:
+            self.finish(reason)
+
+        # Closing transport flushes data that have not been sent yet
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+## Class serving one session on selector server with non-blocking socket
+#
+#  Timeout of session is not bound to the socket, selector server keeps it as deadline on its timer wheel.
+#
+class SelectorSession(Session):
+
+    __slots__ = ("connection", "writes")
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param connection Non-blocking connection to client
+    #  @param address Tuple of IPv4 address and port of connected client
+    #
+    def __init__(self, connection, address) -> None:
+        Session.__init__(self, address)
+        self.connection = connection
+        self.writes = WriteQueue()
+
+    ## Receive available data from connection and process them
+    #
+    #  Replies are queued and as much of them as connection accepts is sent right away.
+    #  Session which is not active anymore is terminated by server once its replies are sent.
+    #
+    #  @param self
+    #
+    #  @returns bool If connection failed or was closed by client false, else true.
+    def read(self) -> bool:
+        if self.usage is not None:
+            started = time.thread_time()
+
+        # Receive data
+        try:
+            received = self.connection.recv_into(self.receive_buffer(), RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            self.finish("error")
+            return False
+
+        # Client closed connection
+        if not received:
+            self.finish("closed")
+            return False
+        if TUNING.quickack:
+            TUNING.received(self.connection)
+
+        # Send all responses at once
+        frames = self.received(received)
+        if frames:
+            self.writes.push(frames)
+            if not self.write():
+                return False
+
+        if self.usage is not None:
+            self.account(Session.RUN, started)
+        return True
+
+    ## Send queued replies, as much as connection accepts
+    #
+    #  @param self
+    #
+    #  @returns bool If connection failed false, else true.
+    def write(self) -> bool:
+        try:
+            self.writes.flush(self.connection)
+        except OSError:
+            self.finish("error")
+            return False
+        return True
+
+
+## Class serving all sessions on one thread with non-blocking sockets, selector and central timer wheel
+#
+class SelectorServer():
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param serversocket Listening server socket
+    #
+    def __init__(self, serversocket) -> None:
+        self.serversocket = serversocket
+        self.serversocket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(serversocket, selectors.EVENT_READ, None)
+        self.selector.register(RESTART.wakeup(), selectors.EVENT_READ, RESTART)
+        self.timers = TimerWheel()
+
+    ## Accept pending connections (up to accept batch)
+    #
+    #  @param self
+    #
+    def accept(self):
+        for _ in range(options.accept_batch):
+            try:
+                (connection, address) = self.serversocket.accept()
+            except (BlockingIOError, InterruptedError):
+                break
+            if not LIMITER.admit(address[0]):
+                SessionSlots.reject(connection, address, "rate_limit")
+                connection.close()
+                continue
+            if not SLOTS.acquire():
+                SessionSlots.reject(connection, address)
+                connection.close()
+                continue
+            connection.setblocking(False)
+            TUNING.accepted(connection)
+            session = SelectorSession(connection, address)
+            self.selector.register(connection, selectors.EVENT_READ, session)
+            self.timers.arm(session, time.monotonic() + session.timeout)
+
+    ## End session and close its connection
+    #
+    #  @param self
+    #  @param session Session to close
+    #  @param reason Reason of end, unless determined by session itself
+    #
+    def close(self, session, reason="error"):
+        try:
+            session.finish(reason)
+        finally:
+            self.timers.cancel(session)
+            self.selector.unregister(session.connection)
+            session.connection.close()
+            SLOTS.release()
+
+    ## Update events selected for session according to its write queue, close ended session once its replies are sent
+    #
+    #  Session whose client does not read its replies (queue above high water mark) is not read from until they are sent,
+    #  it times out when the client does not read them in time.
+    #
+    #  @param self
+    #  @param session Session
+    #
+    def update(self, session):
+        if session.writes.empty():
+            if not session.active:
+                self.close(session)
+                return
+            events = selectors.EVENT_READ
+        elif session.writes.above_high_water() or not session.active:
+            events = selectors.EVENT_WRITE
+        else:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE
+        if self.selector.get_key(session.connection).events != events:
+            self.selector.modify(session.connection, events, session)
+
+    ## Stop accepting connections, served sessions continue
+    #
+    #  @param self
+    #
+    def stop_accepting(self):
+        self.selector.unregister(self.serversocket)
+        self.selector.unregister(RESTART.pipe[0])
+        self.serversocket.close()
 
-## Get port value from stdio.
+    ## Serve clients until interrupted, or until all sessions ended when draining
+    #
+    #  Every received data re-arm deadline of session with its current timeout (which changes with recharging).
+    #
+    #  @param self
+    #
+    def serve_forever(self):
+        while not RESTART.draining or SLOTS.used:
+            events = self.selector.select(self.timers.timeout(time.monotonic()))
+            for (key, mask) in events:
+                session = key.data
+                if session is None:
+                    self.accept()
+                    continue
+                if session is RESTART:
+                    self.stop_accepting()
+                    continue
+                # Unexpected exception ends only the session which raised it
+                try:
+                    alive = not mask & selectors.EVENT_WRITE or session.write()
+                    if alive and mask & selectors.EVENT_READ:
+                        alive = session.read()
+                except Exception as error:
+                    session.fail(error)
+                    alive = False
+                if not alive:
+                    self.close(session)
+                    continue
+                if mask & selectors.EVENT_READ:
+                    self.timers.arm(session, time.monotonic() + session.timeout)
+                self.update(session)
+
+            for session in self.timers.expire(time.monotonic()):
+                self.close(session, "timeout" if session.writes.empty() else "slow_reader")
+
+
+## Parse command line arguments.
 #
 #  Port needs to be between 1024 and 65353 inclusive.
 #
 #  @returns bool Sucess or failiure
 #
-#  Saves port value into global variable PORT.
-def get_port() -> bool:
+#  Saves port value into global variable port and other options into global variable options.
+def parse_arguments() -> bool:
+
+    parser = argparse.ArgumentParser(description="TCP/IP server guiding robots to zero coordinates.")
+    parser.add_argument("port", nargs="?", help="port to listen on (1024 - 65353)")
+    parser.add_argument("--config", metavar="PATH",
+                        help="read default values of options from JSON object, keys are option names (e.g. {\"recv_size\": 4096, \"quickack\": true}), command line overrides them")
+    parser.add_argument("--engine", choices=["threads", "asyncio", "selectors"], default="threads",
+                        help="serve each robot in its own thread, all robots as coroutines on one event loop or all robots with non-blocking sockets on one selector (default: threads)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes serving robots (default: 1)")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help="give every worker its own listening socket with SO_REUSEPORT instead of sharing one")
+    parser.add_argument("--backlog", type=int, default=5,
+                        help="length of queue of pending connections of listening socket (default: 5)")
+    parser.add_argument("--accept-batch", type=int, default=16,
+                        help="maximum number of pending connections accepted per wakeup (default: 16)")
+    parser.add_argument("--nodelay", action=argparse.BooleanOptionalAction, default=True,
+                        help="send replies right away with TCP_NODELAY, --no-nodelay leaves Nagle's algorithm on (default: on)")
+    parser.add_argument("--quickack", action="store_true",
+                        help="acknowledge received data right away with TCP_QUICKACK, set after every receive")
+    parser.add_argument("--keepalive", action="store_true",
+                        help="enable TCP keepalive probes on connections (SO_KEEPALIVE)")
+    parser.add_argument("--rcvbuf", type=int, metavar="BYTES",
+                        help="size of receive buffer of sockets (SO_RCVBUF, default: system default)")
+    parser.add_argument("--sndbuf", type=int, metavar="BYTES",
+                        help="size of send buffer of sockets (SO_SNDBUF, default: system default)")
+    parser.add_argument("--recv-size", type=int, default=1024, metavar="BYTES",
+                        help="maximum number of bytes received at once per session (default: 1024)")
+    parser.add_argument("--timeout", type=float, default=1, metavar="SECONDS",
+                        help="time to wait for message of robot (default: 1)")
+    parser.add_argument("--timeout-recharging", type=float, default=5, metavar="SECONDS",
+                        help="time to wait for robot to finish recharging (default: 5)")
+    parser.add_argument("--max-sessions", type=int, default=0,
+                        help="maximum number of concurrently served sessions per worker, connections over it are rejected (default: 0 for unlimited)")
+    parser.add_argument("--accept-rate", type=float, default=0, metavar="N",
+                        help="accept at most N connections per second from one client address, others are reset (default: 0 for unlimited)")
+    parser.add_argument("--accept-burst", type=int, default=20, metavar="N",
+                        help="connections accepted from one client address at once before --accept-rate applies (default: 20)")
+    parser.add_argument("--session-time", type=float, default=0, metavar="SECONDS",
+                        help="disconnect session lasting longer than SECONDS (default: 0 for unlimited)")
+    parser.add_argument("--session-bytes", type=int, default=0, metavar="BYTES",
+                        help="disconnect session which received more than BYTES (default: 0 for unlimited)")
+    parser.add_argument("--write-high-water", type=int, default=65536, metavar="BYTES",
+                        help="stop reading from client while more than BYTES of replies to it wait to be sent (default: 65536)")
+    parser.add_argument("--planner", choices=["simple", "search"], default="simple",
+                        help="move straight to zero coords and sidestep obstacles, or remember obstacles and search for shortest path around them (default: simple)")
+    parser.add_argument("--obstacle-map", metavar="PATH",
+                        help="share obstacles found by all sessions and workers in memory-mapped file, used by search planner")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve metrics in Prometheus text format on /metrics of this local port (worker N uses port + N)")
+    parser.add_argument("--log-rate", type=float, default=100,
+                        help="maximum number of logged records per second of every session event, e.g. connected or syntax_error (default: 100)")
+    parser.add_argument("--log-sample", type=float, default=1.0,
+                        help="ratio of session events which are logged (default: 1.0)")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="record inbound and outbound data of all sessions with timestamps into binary trace file, see tools/replay.py")
+    parser.add_argument("--accounting", action="store_true",
+                        help="account CPU time and calls of processing parts per session, most expensive sessions are served on /sessions/top of admin port")
+    parser.add_argument("--profile-output", default="profile.folded", metavar="PATH",
+                        help="SIGUSR2 starts sampling profiler, next one writes collapsed stacks to PATH.<pid> (default: profile.folded)")
+    parser.add_argument("--resumption", action="store_true",
+                        help="hand out ticket after login (108 TICKET <ticket>), robot reconnecting within 60 s sends RESUME <ticket> as username and continues its session")
+    parser.add_argument("--resumption-file", metavar="PATH",
+                        help="with --resumption, keep states of interrupted sessions in memory-mapped file, so tickets survive hot restart (default: shared only by workers)")
+    parser.add_argument("--pipeline", type=int, default=1, metavar="DEPTH",
+                        help="with search planner, send up to DEPTH commands at once while path ahead is known to be clear (default: 1, disabled)")
+
+    global options
+    options = parser.parse_args()
+
+    # Values from config file are defaults, so options given on command line override them
+    if options.config is not None:
+        try:
+            with open(options.config) as file:
+                config = json.load(file)
+        except (OSError, ValueError):
+            LOGGER.log("invalid_arguments", "error", message="Config file cannot be read")
+            return False
+        if not isinstance(config, dict):
+            LOGGER.log("invalid_arguments", "error", message="Config file needs to contain JSON object")
+            return False
+        # Defaults are not checked by argparse, values are converted and checked the same way as on command line
+        actions = {action.dest: action for action in parser._actions}
+        defaults = {}
+        for (key, value) in config.items():
+            name = key.replace("-", "_")
+            if name not in vars(options) or name == "config":
+                LOGGER.log("invalid_arguments", "error", message="Unknown option in config file: " + key)
+                return False
+            action = actions[name]
+            if action.nargs == 0:
+                # Flag
+                valid = isinstance(value, bool)
+            else:
+                valid = isinstance(value, (str, int, float)) and not isinstance(value, bool) and not (action.type is int and isinstance(value, float))
+                if valid:
+                    try:
+                        value = (action.type or str)(value)
+                    except ValueError:
+                        valid = False
+                valid = valid and (action.choices is None or value in action.choices)
+            if not valid:
+                LOGGER.log("invalid_arguments", "error", message="Invalid value of option in config file: " + key)
+                return False
+            defaults[name] = value
+        parser.set_defaults(**defaults)
+        options = parser.parse_args()
 
-    if (len(sys.argv) <= 1):
-        print("ERR: Add port as an argument")
+    if (options.port == None):
+        LOGGER.log("invalid_arguments", "error", message="Add port as an argument")
         return False
     
     try:
         global port 
-        port = int(sys.argv[1])
+        port = int(options.port)
     except:
-        print("ERR: Port is not a number")
+        LOGGER.log("invalid_arguments", "error", message="Port is not a number")
         return False
 
     if (port == None or port <= 1023 or port > 65353):
-        print("ERR: Invalid port")
+        LOGGER.log("invalid_arguments", "error", message="Invalid port")
+        return False
+
+    if options.workers < 1 or options.backlog < 1 or options.accept_batch < 1 or options.pipeline < 1:
+        LOGGER.log("invalid_arguments", "error", message="Number of workers, backlog, accept batch and pipeline depth need to be positive")
+        return False
+
+    if options.max_sessions < 0 or options.write_high_water < 0:
+        LOGGER.log("invalid_arguments", "error", message="Maximum number of sessions and write high water mark cannot be negative")
+        return False
+
+    if options.accept_rate < 0 or options.accept_burst < 1 or options.session_time < 0 or options.session_bytes < 0:
+        LOGGER.log("invalid_arguments", "error", message="Accept rate and session budget cannot be negative, accept burst needs to be positive")
+        return False
+
+    if options.pipeline > 1 and options.planner != "search":
+        LOGGER.log("invalid_arguments", "error", message="Pipelining needs search planner")
+        return False
+
+    if options.resumption_file is not None and not options.resumption:
+        LOGGER.log("invalid_arguments", "error", message="Resumption file needs --resumption")
+        return False
+
+    if options.recv_size < 1 or options.timeout <= 0 or options.timeout_recharging <= 0 \
+            or (options.rcvbuf is not None and options.rcvbuf < 1) or (options.sndbuf is not None and options.sndbuf < 1):
+        LOGGER.log("invalid_arguments", "error", message="Receive size, timeouts and buffer sizes need to be positive")
+        return False
+
+    if options.quickack and not hasattr(socket, "TCP_QUICKACK"):
+        LOGGER.log("invalid_arguments", "error", message="TCP_QUICKACK is not supported")
+        return False
+
+    if options.reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+        LOGGER.log("invalid_arguments", "error", message="SO_REUSEPORT is not supported")
         return False
 
     return True
 
-## Creates server socket, starts listening for connections, when connected creates new thread for serving client.
+## Creates listening server socket
 #
-def main():
-    if (not get_port()):
-        return None
-    
+#  @param reuse_port If true, sets SO_REUSEPORT so more sockets can listen on the same port
+#
+#  @returns socket|None Listening socket or None if failed
+#
+def create_server_socket(reuse_port):
     try:
         serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        print("OK: Socket created")
+        if reuse_port:
+            serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        LOGGER.log("socket_created")
     except:
-        print("ERR: Socket creation failed")
+        LOGGER.log("socket_failed", "error", message="Socket creation failed")
+        return None
+
+    try:
+        TUNING.listening(serversocket)
+    except OSError:
+        LOGGER.log("socket_failed", "error", message="Socket buffer sizes cannot be set")
+        serversocket.close()
         return None
 
     try:
         global HOST
         global port
         serversocket.bind((HOST, port))
-        print("OK: Socket binded")
+        LOGGER.log("socket_bound", host=HOST, port=port)
     except:
-        print("ERR: Socket bind failed")
+        LOGGER.log("socket_failed", "error", message="Socket bind failed")
+        serversocket.close()
         return None
 
-    serversocket.listen(5)
+    serversocket.listen(options.backlog)
+    return serversocket
 
-    server_threads = []
+## Takes over listening sockets of old server process on hot restart, or creates new ones
+#
+#  @param count Number of sockets, more of them only with SO_REUSEPORT
+#  @param reuse_port If true, sets SO_REUSEPORT so more sockets can listen on the same port
+#
+#  @returns list|None Listening sockets or None if failed
+#
+def server_sockets(count, reuse_port):
+    if RESTART.inherited is None:
+        serversockets = [create_server_socket(reuse_port) for _ in range(count)]
+        return None if None in serversockets else serversockets
 
-    try:
+    if len(RESTART.inherited) != count:
+        LOGGER.log("restart_failed", "error", message="Number of inherited listening sockets does not match workers")
+        return None
+    for serversocket in RESTART.inherited:
+        # Backlog and buffer sizes could have changed
+        try:
+            TUNING.listening(serversocket)
+        except OSError:
+            LOGGER.log("socket_failed", "error", message="Socket buffer sizes cannot be set")
+            return None
+        serversocket.listen(options.backlog)
+    LOGGER.log("socket_inherited", sockets=count)
+    return RESTART.inherited
+
+## Accepts connections and creates new thread for serving each client.
+#
+#  Waits for listening socket to become readable and then accepts all pending connections (up to accept batch) at once.
+#  Connections over the limit of session slots are rejected.
+#  When draining, stops accepting and returns once all sessions ended.
+#
+#  @param serversocket Listening server socket
+#
+def serve_threads(serversocket):
+    serversocket.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(serversocket, selectors.EVENT_READ)
+    selector.register(RESTART.wakeup(), selectors.EVENT_READ)
+
+    while not RESTART.draining:
+        selector.select()
+        for _ in range(options.accept_batch):
+            # Socket can be shared with other workers, which could have accepted the connection first
+            try:
+                (connection, address) = serversocket.accept()
+            except (BlockingIOError, InterruptedError):
+                break
+            if not LIMITER.admit(address[0]):
+                SessionSlots.reject(connection, address, "rate_limit")
+                connection.close()
+                continue
+            if not SLOTS.acquire():
+                SessionSlots.reject(connection, address)
+                connection.close()
+                continue
+            TUNING.accepted(connection)
+            # Thread is not referenced after it ends, so finished sessions are reclaimed
+            session = ServerThread(connection, address)
+            try:
+                session.start()
+            except RuntimeError:
+                # No more threads can be started
+                session.finish("error")
+                connection.close()
+                SLOTS.release()
+
+    selector.close()
+    serversocket.close()
+    RESTART.wait_for_sessions()
+
+## Accepts connections and serves all clients as coroutines on one asyncio event loop.
+#
+#  Event loop itself accepts up to backlog pending connections per wakeup.
+#  Connections over the limit of session slots are rejected.
+#  When draining, stops accepting and returns once all sessions ended.
+#
+#  @param serversocket Listening server socket
+#
+async def serve_asyncio(serversocket):
+
+    async def serve_client(reader, writer):
+        address = writer.get_extra_info("peername")
+        if not LIMITER.admit(address[0]):
+            SessionSlots.reject(writer.get_extra_info("socket"), address, "rate_limit")
+            writer.transport.abort()
+            return
+        if not SLOTS.acquire():
+            SessionSlots.reject(writer.get_extra_info("socket"), address)
+            writer.transport.abort()
+            return
+        TUNING.accepted(writer.get_extra_info("socket"))
+        try:
+            await AsyncServerSession(reader, writer).run()
+        finally:
+            SLOTS.release()
+
+    server = await asyncio.start_server(serve_client, sock=serversocket, backlog=options.backlog)
+    draining = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    wakeup = RESTART.wakeup()
+    loop.add_reader(wakeup, draining.set)
+    async with server:
+        await draining.wait()
+    loop.remove_reader(wakeup)
+
+    while SLOTS.used:
+        await asyncio.sleep(RESTART.POLL)
+
+## Starts serving metrics on local admin port in background thread
+#
+#  After hot restart, the port is bound once the old process releases it.
+#
+#  @param index Index of worker, added to admin port so every worker has its own
+#
+def start_admin_server(index):
+    if options.metrics_port is None:
+        return
+
+    def serve_admin():
+        deadline = time.monotonic() + RESTART.ADMIN_WAIT
         while True:
-            (connection, address) = serversocket.accept()
-            clientsocket = ServerThread(connection, address)
-            server_threads.append(clientsocket)
-            clientsocket.start()
+            try:
+                admin_server = http.server.ThreadingHTTPServer((HOST, options.metrics_port + index), AdminHandler)
+                break
+            except OSError:
+                if RESTART.inherited is None or time.monotonic() >= deadline:
+                    LOGGER.log("admin_port_failed", "error", port=options.metrics_port + index)
+                    return
+                time.sleep(RESTART.POLL)
+        admin_server.daemon_threads = True
+        RESTART.admin_server = admin_server
+        if RESTART.draining:
+            RESTART.close_admin_server(admin_server)
+            return
+        admin_server.serve_forever()
+
+    threading.Thread(target=serve_admin, daemon=True).start()
+
+## Serves clients on listening socket with selected engine until interrupted.
+#
+#  @param serversocket Listening server socket
+#
+def serve(serversocket):
+    if options.engine == "asyncio":
+        asyncio.run(serve_asyncio(serversocket))
+    elif options.engine == "selectors":
+        SelectorServer(serversocket).serve_forever()
+    else:
+        serve_threads(serversocket)
+
+## Handle SIGTERM same as SIGINT, so server (and every worker) exits by the same path and flushes its log and capture
+#
+#  @param signum Number of signal
+#  @param frame Interrupted stack frame
+#
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+## Forks worker processes, each serving clients with selected engine.
+#
+#  Workers either share one listening socket or (with SO_REUSEPORT) every worker gets its own and kernel distributes connections between them.
+#  Listening sockets are created before forking, so worker which exits unexpectedly is started again with the same socket.
+#  On hot restart, draining is forwarded to every worker and the process exits once all of them drained.
+#
+def serve_workers():
+    serversockets = server_sockets(options.workers if options.reuse_port else 1, options.reuse_port)
+    if serversockets is None:
+        return None
+    RESTART.sockets = serversockets
+    if not options.reuse_port:
+        serversockets = serversockets * options.workers
+
+    workers = {}
+
+    def start_worker(index):
+        pid = os.fork()
+        if pid == 0:
+            # Worker never returns into code of master, even when interrupted while exiting
+            try:
+                signal.signal(signal.SIGTERM, interrupt)
+                signal.signal(signal.SIGUSR2, toggle_profiler)
+                signal.signal(signal.SIGUSR1, RESTART.drain)
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                for other in set(serversockets):
+                    if other is not serversockets[index]:
+                        other.close()
+                start_admin_server(index)
+                try:
+                    serve(serversockets[index])
+                except:
+                    pass
+
+                # Worker gets SIGTERM both from master and from kill of process group, later signals must not interrupt flushing
+                signal.signal(signal.SIGTERM, signal.SIG_IGN)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                LOGGER.close()
+                if Session.capture is not None:
+                    Session.capture.close()
+            finally:
+                os._exit(0)
+        workers[pid] = index
+
+    signal.signal(signal.SIGTERM, interrupt)
+
+    # Profiler is toggled in every worker
+    def forward(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGUSR2, forward)
+
+    def drain(signum, frame):
+        RESTART.draining = True
+        forward(signum, frame)
+
+    signal.signal(signal.SIGUSR1, drain)
+    signal.signal(signal.SIGHUP, RESTART.start)
+
+    for index in range(options.workers):
+        start_worker(index)
+    LOGGER.log("workers_started", workers=options.workers)
+    RESTART.ready()
+
+    try:
+        while workers:
+            (pid, status) = os.wait()
+            index = workers.pop(pid, None)
+            if index is not None and not RESTART.draining:
+                LOGGER.log("worker_restarted", "error", worker=index)
+                start_worker(index)
     except:
+        pass
+
+    # Stopping workers is not interrupted by further signals (kill of process group)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in workers:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+    for serversocket in set(serversockets):
         serversocket.close()
-        print("OK: Exiting")
-        sys.exit(0)
+    LOGGER.log("exiting")
+    sys.exit(0)
+
+## Creates server socket, starts listening for connections, serves clients with selected engine.
+#
+def main():
+    if (not parse_arguments()):
+        return None
+    RESTART.inherit()
+
+    LOGGER.configure(options.log_rate if options.log_rate > 0 else None, options.log_sample)
+    SLOTS.limit = options.max_sessions or None
+    WriteQueue.high_water = options.write_high_water
+
+    global RECV_SIZE
+    global TIMEOUT
+    global TIMEOUT_RECHARGING
+    RECV_SIZE = options.recv_size
+    TIMEOUT = options.timeout
+    TIMEOUT_RECHARGING = options.timeout_recharging
+    TUNING.nodelay = options.nodelay
+    TUNING.quickack = options.quickack
+    TUNING.keepalive = options.keepalive
+    TUNING.rcvbuf = options.rcvbuf
+    TUNING.sndbuf = options.sndbuf
+
+    LIMITER.rate = options.accept_rate or None
+    LIMITER.burst = options.accept_burst
+    Session.time_budget = options.session_time or None
+    Session.byte_budget = options.session_bytes or None
+
+    Session.accounting = options.accounting
+    signal.signal(signal.SIGUSR2, toggle_profiler)
+
+    Session.Movement.planning = options.planner == "search"
+    Session.Movement.pipeline_depth = options.pipeline
+    if options.resumption:
+        try:
+            Session.Authentication.tickets = ResumptionTickets(options.resumption_file)
+        except (OSError, ValueError):
+            LOGGER.log("resumption_file_failed", "error", path=options.resumption_file)
+            return None
+
+    if options.obstacle_map is not None:
+        try:
+            Session.Movement.obstacle_map = ObstacleMap(options.obstacle_map)
+        except (OSError, ValueError):
+            LOGGER.log("obstacle_map_failed", "error", path=options.obstacle_map)
+            return None
+
+    if options.capture is not None:
+        try:
+            Session.capture = Capture(options.capture, {"planner": options.planner, "pipeline": options.pipeline,
+                                                        "obstacle_map": options.obstacle_map is not None},
+                                      RESTART.inherited is not None)
+        except OSError:
+            LOGGER.log("capture_failed", "error", path=options.capture)
+            return None
+        atexit.register(Session.capture.close)
+
+    if options.workers > 1:
+        return serve_workers()
+
+    serversockets = server_sockets(1, options.reuse_port)
+    if serversockets is None:
+        return None
+    serversocket = serversockets[0]
+    RESTART.sockets = serversockets
+
+    start_admin_server(0)
+    signal.signal(signal.SIGTERM, interrupt)
+    signal.signal(signal.SIGUSR1, RESTART.drain)
+    signal.signal(signal.SIGHUP, RESTART.start)
+    RESTART.ready()
+
+    try:
+        serve(serversocket)
+    except:
+        pass
+    serversocket.close()
+    LOGGER.log("exiting")
+    sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+
+
+
+## Offline vectorized fleet simulator for evaluating movement strategies of the BI-PSI server.
+#
+# Drives many virtual robots at once without any connection: positions, directions, queued commands and obstacle grids are NumPy arrays
+# and every step executes one command of every robot and processes its reply with the decision logic of Movement (calculate_move,
+# calculate_direction and unstuck of simple strategy) in batched form.
+# Reports distribution of commands per robot, failure rates against move limit and robots simulated per second.
+#
+# With --verify N, the first N robots are also driven through Movement of the server itself and results must be the same,
+# so the batched logic does not silently diverge from the server.
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import server
+from server import MESSAGES
+
+## Offsets of coordinates after moving in each direction, same as in Movement
+#
+STEPS = np.array(server.Session.Movement.STEPS, dtype=np.int64)
+
+## Commands queued for robot
+#
+MOVE = 0
+LEFT = 1
+RIGHT = 2
+PICK_UP = 3
+
+## Outcomes of robot
+#
+RUNNING = 0
+SUCCESS = 1
+MOVE_LIMIT = 2
+OUTSIDE_GOAL = 3
+OUTCOMES = {SUCCESS: "success", MOVE_LIMIT: "move limit exceeded", OUTSIDE_GOAL: "picked up outside of goal"}
+
+## Maximum number of commands queued for one robot (unstuck queues 4)
+#
+QUEUE = 8
+
+
+## Generate obstacle grids
+#
+#  Obstacles are isolated (no two obstacles next to each other, none at zero coords), as expected by server specification:
+#  candidate cell is kept only if it has the highest random priority among candidates around it.
+#
+#  @param count Number of grids
+#  @param size Grid spans from -size to size on both axes
+#  @param density Probability of cell being candidate for obstacle
+#  @param rng NumPy random generator
+#
+#  @returns numpy.ndarray Boolean array of shape (count, 2 * size + 1, 2 * size + 1), indexed by coords + size
+#
+def generate_fields(count, size, density, rng):
+    side = 2 * size + 1
+    candidates = rng.random((count, side, side)) < density
+    priority = np.where(candidates, rng.random((count, side, side)), -1.0)
+    padded = np.pad(priority, ((0, 0), (1, 1), (1, 1)), constant_values=-1.0)
+    highest = np.max([padded[:, 1 + dx:1 + dx + side, 1 + dy:1 + dy + side] for dx in (-1, 0, 1) for dy in (-1, 0, 1)], axis=0)
+    fields = candidates & (priority >= highest)
+    fields[:, size, size] = False
+    return fields
+
+## Batch of robots driven by simple strategy of Movement
+#
+#  Server side state mirrors attributes of Movement (x, y, direction, last_moved, first_move, unstuck_moves_left, moves),
+#  robot side state is its real position and direction. Unknown direction is -1.
+#
+class Fleet():
+
+    ## Names of per robot arrays, filtered together when finished robots are removed
+    #
+    STATE = ("index", "field", "robot_x", "robot_y", "robot_direction", "x", "y", "direction", "last_moved", "first_move",
+             "unstuck_moves_left", "moves", "executed", "hits", "queue", "head", "count")
+
+    ## Constructor
+    #
+    #  Every robot has TURN LEFT queued, sent by server after successful authentication.
+    #
+    #  @param self
+    #  @param fields Obstacle grids (see generate_fields)
+    #  @param field Index of grid of every robot
+    #  @param starts Start coords of every robot, array of shape (robots, 2)
+    #  @param directions Start direction of every robot
+    #  @param limit Robot fails after this many commands
+    #
+    def __init__(self, fields, field, starts, directions, limit) -> None:
+        count = len(field)
+        self.fields = fields
+        self.size = fields.shape[1] // 2
+        self.limit = limit
+
+        self.index = np.arange(count)
+        self.field = field
+        self.robot_x = starts[:, 0].copy()
+        self.robot_y = starts[:, 1].copy()
+        self.robot_direction = directions.copy()
+
+        self.x = np.zeros(count, dtype=np.int64)
+        self.y = np.zeros(count, dtype=np.int64)
+        self.direction = np.full(count, -1, dtype=np.int64)
+        self.last_moved = np.zeros(count, dtype=bool)
+        self.first_move = np.ones(count, dtype=bool)
+        self.unstuck_moves_left = np.zeros(count, dtype=np.int64)
+        self.moves = np.zeros(count, dtype=np.int64)
+        self.executed = np.zeros(count, dtype=np.int64)
+        self.hits = np.zeros(count, dtype=np.int64)
+
+        self.queue = np.zeros((count, QUEUE), dtype=np.int8)
+        self.head = np.zeros(count, dtype=np.int64)
+        self.count = np.zeros(count, dtype=np.int64)
+        self.push(np.ones(count, dtype=bool), LEFT)
+
+        ## Results of finished robots by index: commands executed, obstacle hits, outcome
+        self.results_executed = np.zeros(count, dtype=np.int64)
+        self.results_hits = np.zeros(count, dtype=np.int64)
+        self.results_outcome = np.zeros(count, dtype=np.int8)
+
+    ## Append command to queues of selected robots
+    #
+    #  @param self
+    #  @param mask Selected robots
+    #  @param command Command
+    #
+    def push(self, mask, command):
+        rows = np.nonzero(mask)[0]
+        self.queue[rows, (self.head[rows] + self.count[rows]) % QUEUE] = command
+        self.count[rows] += 1
+
+    ## Queue move (Movement.move)
+    #
+    #  @param self
+    #  @param mask Selected robots
+    #
+    def move(self, mask):
+        self.push(mask, MOVE)
+        self.last_moved |= mask
+        self.moves += mask
+
+    ## Queue rotation (Movement.rotate)
+    #
+    #  @param self
+    #  @param mask Selected robots
+    #  @param left Rotate anticlockwise, else clockwise (per robot)
+    #
+    def rotate(self, mask, left):
+        self.push(mask & left, LEFT)
+        self.push(mask & ~left, RIGHT)
+        known = mask & (self.direction >= 0)
+        self.direction = np.where(known, (self.direction + np.where(left, 1, -1)) % 4, self.direction)
+        self.last_moved &= ~mask
+        self.moves += mask
+
+    ## Queue request to pick up message (Movement.get_message)
+    #
+    #  @param self
+    #  @param mask Selected robots
+    #
+    def get_message(self, mask):
+        self.push(mask, PICK_UP)
+
+    ## Choose direction to move in (first part of Movement.calculate_move)
+    #
+    #  @param self
+    #
+    #  @returns numpy.ndarray Target direction, -1 at zero coords
+    #
+    def target_direction(self):
+        return np.where(self.x != 0, np.where(self.x > 0, 2, 0),
+                        np.where(self.y != 0, np.where(self.y > 0, 3, 1), -1))
+
+    ## Queue next move to zero coords (Movement.calculate_move)
+    #
+    #  @param self
+    #  @param mask Selected robots
+    #
+    def calculate_move(self, mask):
+        target = self.target_direction()
+        goal = mask & (target < 0)
+        self.last_moved &= ~goal
+        self.get_message(goal)
+        self.calculate_direction(mask & ~goal, target)
+
+    ## Move in target direction or rotate towards it (Movement.calculate_direction)
+    #
+    #  @param self
+    #  @param mask Selected robots
+    #  @param target Target direction of every robot
+    #
+    def calculate_direction(self, mask, target):
+        forward = mask & ((self.direction < 0) | (self.direction == target))
+        difference = target - self.direction
+        right = mask & ~forward & ((difference == -1) | (difference == 3))
+        self.move(forward)
+        self.rotate(mask & ~forward, ~right)
+
+    ## Queue sidestep around obstacle (Movement.unstuck)
+    #
+    #  @param self
+    #  @param mask Selected robots
+    #
+    def unstuck(self, mask):
+        right = (self.direction >= 0) & (((self.x > 0) & (self.y < 0)) | ((self.x <= 0) & (self.y > 0)))
+        self.rotate(mask, ~right)
+        self.move(mask)
+        self.rotate(mask, right)
+        self.move(mask)
+        self.unstuck_moves_left = np.where(mask, 4, self.unstuck_moves_left)
+
+    ## Check if cells are obstacles, cells outside of grid are free
+    #
+    #  @param self
+    #  @param x Coords x
+    #  @param y Coords y
+    #
+    #  @returns numpy.ndarray Cells are obstacles
+    #
+    def blocked(self, x, y):
+        inside = (np.abs(x) <= self.size) & (np.abs(y) <= self.size)
+        return inside & self.fields[self.field, np.clip(x + self.size, 0, 2 * self.size), np.clip(y + self.size, 0, 2 * self.size)]
+
+    ## Execute one queued command of every robot and process replies (Movement.process_message)
+    #
+    #  @param self
+    #
+    #  @returns numpy.ndarray Robots which finished
+    #
+    def step(self):
+        rows = np.arange(len(self.index))
+        command = self.queue[rows, self.head]
+        self.head = (self.head + 1) % QUEUE
+        self.count -= 1
+
+        # Robot executes command
+        picking = command == PICK_UP
+        self.executed += ~picking
+        moving = command == MOVE
+        target_x = self.robot_x + STEPS[self.robot_direction, 0]
+        target_y = self.robot_y + STEPS[self.robot_direction, 1]
+        hit = moving & self.blocked(target_x, target_y)
+        self.hits += hit
+        moved = moving & ~hit
+        self.robot_x = np.where(moved, target_x, self.robot_x)
+        self.robot_y = np.where(moved, target_y, self.robot_y)
+        self.robot_direction = np.where(command == LEFT, (self.robot_direction + 1) % 4,
+                                        np.where(command == RIGHT, (self.robot_direction - 1) % 4, self.robot_direction))
+
+        at_goal = (self.robot_x == 0) & (self.robot_y == 0)
+        outcome = np.where(picking, np.where(at_goal, SUCCESS, OUTSIDE_GOAL),
+                           np.where(self.executed > self.limit, MOVE_LIMIT, RUNNING))
+        replying = outcome == RUNNING
+
+        # Server processes reported position
+        (new_x, new_y) = (self.robot_x, self.robot_y)
+        later = replying & ~self.first_move
+        stuck = later & self.last_moved & (new_x == self.x) & (new_y == self.y) & (self.unstuck_moves_left <= 0)
+        self.unstuck(stuck)
+        reported = np.where(new_x > self.x, 0, np.where(new_x < self.x, 2, np.where(new_y > self.y, 1, np.where(new_y < self.y, 3, self.direction))))
+        self.direction = np.where(later, reported, self.direction)
+        self.x = np.where(replying, new_x, self.x)
+        self.y = np.where(replying, new_y, self.y)
+
+        first = replying & self.first_move
+        self.first_move &= ~first
+        first_at_goal = first & (self.x == 0) & (self.y == 0)
+        self.get_message(first_at_goal)
+        self.move(first & ~first_at_goal)
+
+        waiting = later & (self.unstuck_moves_left > 0)
+        self.unstuck_moves_left -= waiting
+        self.calculate_move(later & ~waiting)
+
+        finished = ~replying
+        self.results_executed[self.index[finished]] = self.executed[finished]
+        self.results_hits[self.index[finished]] = self.hits[finished]
+        self.results_outcome[self.index[finished]] = outcome[finished]
+        return finished
+
+    ## Remove finished robots from per robot arrays
+    #
+    #  @param self
+    #  @param finished Robots which finished
+    #
+    def compact(self, finished):
+        keep = ~finished
+        for name in self.STATE:
+            setattr(self, name, getattr(self, name)[keep])
+
+    ## Step all robots until every one of them finished
+    #
+    #  @param self
+    #
+    def run(self):
+        while len(self.index):
+            self.compact(self.step())
+
+
+## Batch of robots which move along y first, then along x
+#
+#  Example of alternative strategy, differs from simple strategy only in target direction.
+#
+class YFirstFleet(Fleet):
+
+    def target_direction(self):
+        return np.where(self.y != 0, np.where(self.y > 0, 3, 1),
+                        np.where(self.x != 0, np.where(self.x > 0, 2, 0), -1))
+
+
+## Strategies by name
+#
+STRATEGIES = {"simple": Fleet, "y-first": YFirstFleet}
+
+## Drive one robot through Movement of the server
+#
+#  @param field Obstacle grid of robot
+#  @param start Start coords
+#  @param direction Start direction
+#  @param limit Robot fails after this many commands
+#
+#  @returns tuple Commands executed, obstacle hits and outcome
+#
+def simulate_movement(field, start, direction, limit) -> tuple:
+    size = field.shape[0] // 2
+    outbox = []
+    movement = server.Session.Movement(outbox)
+    commands = collections.deque([MESSAGES["SERVER_TURN_LEFT"]])
+    (x, y) = start
+    (executed, hits) = (0, 0)
+    while True:
+        command = commands.popleft()
+        if command == MESSAGES["SERVER_PICK_UP"]:
+            return (executed, hits, SUCCESS if (x, y) == (0, 0) else OUTSIDE_GOAL)
+        executed += 1
+        if command == MESSAGES["SERVER_MOVE"]:
+            (target_x, target_y) = (x + int(STEPS[direction, 0]), y + int(STEPS[direction, 1]))
+            if abs(target_x) <= size and abs(target_y) <= size and field[target_x + size, target_y + size]:
+                hits += 1
+            else:
+                (x, y) = (target_x, target_y)
+        elif command == MESSAGES["SERVER_TURN_LEFT"]:
+            direction = (direction + 1) % 4
+        elif command == MESSAGES["SERVER_TURN_RIGHT"]:
+            direction = (direction - 1) % 4
+        if executed > limit:
+            return (executed, hits, MOVE_LIMIT)
+        movement.process_message("OK " + str(x) + " " + str(y))
+        commands.extend(outbox)
+        outbox.clear()
+
+## Generate robots of one batch
+#
+#  @param fields Obstacle grids
+#  @param count Number of robots
+#  @param size Robots start within -size..size on both axes
+#  @param rng NumPy random generator
+#
+#  @returns tuple Grid index, start coords and start direction of every robot
+#
+def generate_robots(fields, count, size, rng) -> tuple:
+    field = rng.integers(0, len(fields), count)
+    starts = rng.integers(-size, size + 1, (count, 2))
+    grid = fields.shape[1] // 2
+    while True:
+        blocked = fields[field, starts[:, 0] + grid, starts[:, 1] + grid]
+        if not blocked.any():
+            break
+        starts[blocked] = rng.integers(-size, size + 1, (int(blocked.sum()), 2))
+    directions = rng.integers(0, 4, count)
+    return (field, starts, directions)
+
+## Simulate all robots with strategy
+#
+#  Every strategy is evaluated on the same robots and fields (same seed).
+#
+#  @param settings Parsed command line arguments
+#  @param strategy Name of strategy
+#
+#  @returns dict Report
+#
+def simulate(settings, strategy) -> dict:
+    rng = np.random.default_rng(settings.seed)
+    fields = generate_fields(settings.fields, settings.field, settings.obstacles, rng)
+    executed = []
+    hits = []
+    outcomes = []
+    mismatched = 0
+    elapsed = 0.0
+    remaining = settings.robots
+    while remaining > 0:
+        count = min(settings.batch, remaining)
+        remaining -= count
+        (field, starts, directions) = generate_robots(fields, count, settings.field, rng)
+
+        started = time.perf_counter()
+        fleet = STRATEGIES[strategy](fields, field, starts, directions, settings.move_limit)
+        fleet.run()
+        elapsed += time.perf_counter() - started
+
+        executed.append(fleet.results_executed)
+        hits.append(fleet.results_hits)
+        outcomes.append(fleet.results_outcome)
+
+        # Only simple strategy is implemented by server
+        if strategy == "simple" and len(executed) == 1:
+            for robot in range(min(settings.verify, count)):
+                expected = simulate_movement(fields[field[robot]], tuple(int(value) for value in starts[robot]), int(directions[robot]), settings.move_limit)
+                result = (int(fleet.results_executed[robot]), int(fleet.results_hits[robot]), int(fleet.results_outcome[robot]))
+                mismatched += result != expected
+
+    executed = np.concatenate(executed)
+    hits = np.concatenate(hits)
+    outcomes = np.concatenate(outcomes)
+    report = {
+        "strategy": strategy,
+        "robots": settings.robots,
+        "elapsed_s": round(elapsed, 3),
+        "robots_per_s": round(settings.robots / elapsed, 1) if elapsed > 0 else None,
+        "outcomes": {name: int((outcomes == outcome).sum()) for (outcome, name) in OUTCOMES.items()},
+        "failure_rate": round(float((outcomes != SUCCESS).mean()), 5),
+        "moves_per_robot": {
+            "mean": round(float(executed.mean()), 2),
+            **{str(percent): int(np.percentile(executed, percent)) for percent in (50, 90, 95, 99)},
+            "max": int(executed.max())
+        },
+        "obstacle_hits_per_robot": round(float(hits.mean()), 3)
+    }
+    if strategy == "simple":
+        report["verified"] = min(settings.verify, settings.robots, settings.batch)
+        report["verify_mismatched"] = mismatched
+    return report
+
+## Print report in human readable form
+#
+#  @param report Report returned by simulate
+#
+def print_report(report):
+    print(report["strategy"])
+    print("  robots/s          " + str(report["robots_per_s"]) + " (" + str(report["robots"]) + " robots in " + str(report["elapsed_s"]) + " s)")
+    print("  outcomes          " + ", ".join(key + ": " + str(value) for (key, value) in report["outcomes"].items()))
+    print("  failure rate      " + str(report["failure_rate"]))
+    print("  moves/robot       " + ", ".join(key + " " + str(value) for (key, value) in report["moves_per_robot"].items()))
+    print("  obstacle hits     " + str(report["obstacle_hits_per_robot"]) + " per robot")
+    if "verified" in report:
+        print("  verified          " + str(report["verified"]) + " robots against Movement, " + str(report["verify_mismatched"]) + " mismatched")
+
+## Parse command line arguments
+#
+#  @returns argparse.Namespace Settings
+#
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Simulate fleets of robots offline with movement strategies of BI-PSI server.")
+    parser.add_argument("--strategies", nargs="+", default=["simple"], choices=list(STRATEGIES), help="compared strategies (default: simple)")
+    parser.add_argument("--robots", type=int, default=100000, help="total number of simulated robots (default: 100000)")
+    parser.add_argument("--batch", type=int, default=100000, help="number of robots simulated at once (default: 100000)")
+    parser.add_argument("--fields", type=int, default=256, help="number of different obstacle grids (default: 256)")
+    parser.add_argument("--field", type=int, default=15, help="robots start and obstacles lie within -field..field on both axes (default: 15)")
+    parser.add_argument("--obstacles", type=float, default=0.08, help="probability of cell being obstacle candidate (default: 0.08)")
+    parser.add_argument("--move-limit", type=int, default=200, help="robot fails after this many commands (default: 200)")
+    parser.add_argument("--verify", type=int, default=100, help="number of robots also driven through Movement of server, results need to match (default: 100)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine readable report")
+    return parser.parse_args()
+
+def main():
+    settings = parse_arguments()
+    server.LOGGER.configure(None, 0.0)
+    reports = [simulate(settings, strategy) for strategy in settings.strategies]
+    if settings.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+    if any(report.get("verify_mismatched") for report in reports):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
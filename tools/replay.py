@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+
+
+## Deterministic replay of traffic captured by the BI-PSI server (--capture).
+#
+# Trace file is memory-mapped and every session is replayed with exactly the recorded chunks of received data (same fragmentation,
+# recharging and moves, so robot meets the same obstacles), either:
+#   - offline, directly against protocol core of the server (Session, the logic ServerThread runs), reporting processing time per chunk,
+#   - or against live server, each session over its own connection, reporting response latency.
+# Replies are compared with recorded ones, so changes of handle_data or Movement which change behaviour show up as mismatched sessions.
+#
+# With --speed 1 (default) chunks are replayed at recorded times, with --speed 0 as fast as possible.
+
+import argparse
+import asyncio
+import json
+import mmap
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import server
+from server import Capture
+
+
+## Trace file mapped into memory
+#
+class Trace():
+
+    ## Constructor
+    #
+    #  Reads all record heads, data stay in mapped file and are returned as views.
+    #  Record cut off at the end of file (server killed while writing) is ignored.
+    #
+    #  @param self
+    #  @param path Path to trace file
+    #
+    def __init__(self, path) -> None:
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        (magic, version, length) = Capture.HEADER.unpack_from(self.map, 0)
+        if magic != Capture.MAGIC or version != Capture.VERSION:
+            raise ValueError("Not a trace file of this version")
+        offset = Capture.HEADER.size
+        self.settings = json.loads(bytes(self.view[offset:offset + length]))
+        offset += length
+
+        ## Records sorted by time: (time, session key, kind, data)
+        self.records = []
+        while offset + Capture.RECORD.size <= len(self.map):
+            (timestamp, pid, session, kind, length) = Capture.RECORD.unpack_from(self.map, offset)
+            offset += Capture.RECORD.size
+            if offset + length > len(self.map):
+                break
+            self.records.append((timestamp, (pid, session), kind, self.view[offset:offset + length]))
+            offset += length
+
+        # Buffers of workers are appended independently
+        self.records.sort(key=lambda record: record[0])
+
+    ## Group records by session
+    #
+    #  Only sessions whose opening was captured are returned.
+    #
+    #  @param self
+    #
+    #  @returns list Lists of records of sessions, ordered by opening time
+    #
+    def sessions(self) -> list:
+        sessions = {}
+        for record in self.records:
+            if record[2] == Capture.OPEN:
+                sessions[record[1]] = []
+            if record[1] in sessions:
+                sessions[record[1]].append(record)
+        return list(sessions.values())
+
+
+## Compute percentile of sorted values
+#
+#  @param values Sorted list of values
+#  @param percent Percentile (0 - 100)
+#
+#  @returns float|None Value or None if there are no values
+#
+def percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+## Create report from collected results
+#
+#  @param sessions Number of replayed sessions
+#  @param mismatched Number of sessions whose replies differ from recorded
+#  @param chunks Number of replayed chunks of received data
+#  @param elapsed Duration of replay in seconds
+#  @param durations Measured durations in seconds, per chunk
+#  @param name Name of measured duration
+#
+#  @returns dict Report
+#
+def report(sessions, mismatched, chunks, elapsed, durations, name) -> dict:
+    durations.sort()
+    return {
+        "sessions": sessions,
+        "mismatched": mismatched,
+        "chunks": chunks,
+        "elapsed_s": round(elapsed, 3),
+        "chunks_per_s": round(chunks / elapsed, 1) if elapsed > 0 else None,
+        name: {key: (round(percentile(durations, float(key)) * 1000, 4) if durations else None)
+               for key in ("50", "90", "99", "99.9")}
+    }
+
+## Configure protocol core the same way as captured server
+#
+#  Obstacle map shared by captured server is not reproduced, sessions planned with it may differ.
+#
+#  @param settings Options of captured server
+#
+def configure(settings):
+    server.LOGGER.configure(None, 0.0)
+    server.Session.Movement.planning = settings.get("planner") == "search"
+    server.Session.Movement.pipeline_depth = settings.get("pipeline", 1)
+
+## Replay trace against protocol core in this process
+#
+#  @param trace Trace
+#  @param speed Replay speed relative to recorded, 0 for as fast as possible
+#
+#  @returns dict Report
+#
+def replay_offline(trace, speed) -> dict:
+    configure(trace.settings)
+    sessions = {}
+    mismatched = 0
+    replayed = 0
+    durations = []
+    first = trace.records[0][0] if trace.records else 0
+    started = time.perf_counter()
+
+    for (timestamp, key, kind, data) in trace.records:
+        if speed:
+            delay = (timestamp - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+        if kind == Capture.OPEN:
+            (host, port) = bytes(data).decode("ascii").rsplit(":", 1)
+            # Replayed session, replies and recorded replies
+            sessions[key] = (server.Session((host, int(port))), bytearray(), bytearray())
+            replayed += 1
+            continue
+        if key not in sessions:
+            continue
+
+        (session, replies, recorded) = sessions[key]
+        if kind == Capture.INBOUND:
+            if session.active:
+                begin = time.perf_counter()
+                frames = session.receive(data)
+                durations.append(time.perf_counter() - begin)
+                replies += b"".join(frames)
+        elif kind == Capture.OUTBOUND:
+            recorded += data
+        elif kind == Capture.CLOSE:
+            session.finish(bytes(data).decode("ascii"))
+            mismatched += replies != recorded
+            del sessions[key]
+
+    # Sessions still open when capture ended
+    for (session, replies, recorded) in sessions.values():
+        mismatched += replies != recorded
+    return report(replayed, mismatched, len(durations), time.perf_counter() - started, durations, "processing_ms")
+
+## Replay one session against live server
+#
+#  Every chunk is sent after its recorded time (relative to start of replay) and after replies to previous chunk arrived,
+#  so slow server delays the session instead of changing what robot sent.
+#
+#  @param settings Parsed command line arguments
+#  @param records Records of session
+#  @param started Start of replay (time.perf_counter)
+#  @param first Time of the first record in trace
+#  @param limit Semaphore limiting concurrently replayed sessions
+#  @param durations List collecting response latencies
+#
+#  @returns bool Replies match recorded replies
+#
+async def replay_session(settings, records, started, first, limit, durations) -> bool:
+    async def wait_until(timestamp):
+        if settings.speed:
+            delay = (timestamp - first) / settings.speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    await wait_until(records[0][0])
+    async with limit:
+        try:
+            (reader, writer) = await asyncio.open_connection(settings.host, settings.port)
+        except OSError:
+            return False
+        # Send every chunk as recorded, without waiting for acknowledgement of previous one
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        matches = True
+        sent = None
+        try:
+            for (timestamp, key, kind, data) in records[1:]:
+                if kind == Capture.INBOUND:
+                    await wait_until(timestamp)
+                    writer.write(data)
+                    await writer.drain()
+                    sent = time.perf_counter()
+                elif kind == Capture.OUTBOUND:
+                    reply = await asyncio.wait_for(reader.readexactly(len(data)), settings.timeout)
+                    if sent is not None:
+                        durations.append(time.perf_counter() - sent)
+                        sent = None
+                    matches = matches and reply == data
+                elif kind == Capture.CLOSE:
+                    # Server ended the session itself (timeout, error or logout), wait for it to close connection
+                    if bytes(data) != b"closed":
+                        matches = matches and await asyncio.wait_for(reader.read(1), settings.timeout) == b""
+                    break
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            matches = False
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        return matches
+
+## Replay trace against live server
+#
+#  @param trace Trace
+#  @param settings Parsed command line arguments
+#
+#  @returns dict Report
+#
+async def replay_live(trace, settings) -> dict:
+    sessions = trace.sessions()
+    limit = asyncio.Semaphore(settings.concurrency)
+    durations = []
+    first = trace.records[0][0] if trace.records else 0
+    started = time.perf_counter()
+    results = await asyncio.gather(*(replay_session(settings, records, started, first, limit, durations) for records in sessions))
+    chunks = sum(1 for records in sessions for record in records if record[2] == Capture.INBOUND)
+    return report(len(sessions), results.count(False), chunks, time.perf_counter() - started, durations, "latency_ms")
+
+## Parse command line arguments
+#
+#  @returns argparse.Namespace Settings
+#
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Replay traffic captured by BI-PSI server offline or against live server.")
+    parser.add_argument("trace", help="trace file written by server with --capture")
+    parser.add_argument("--port", type=int, help="replay against live server on this port instead of offline against protocol core")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed relative to recorded, 0 for as fast as possible (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=1000, help="maximum number of sessions replayed against live server at once")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for reply of live server")
+    parser.add_argument("--json", action="store_true", help="print report as JSON")
+    return parser.parse_args()
+
+def main():
+    settings = parse_arguments()
+    trace = Trace(settings.trace)
+    if settings.port is None:
+        result = replay_offline(trace, settings.speed)
+    else:
+        result = asyncio.run(replay_live(trace, settings))
+
+    if settings.json:
+        print(json.dumps(result, indent=2))
+        return
+    for (key, value) in result.items():
+        if isinstance(value, dict):
+            value = ", ".join("p" + percentile_key + " " + str(duration) for (percentile_key, duration) in value.items())
+        print(key.ljust(16) + str(value))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+
+
+## Robot simulator and end-to-end load generator for the BI-PSI server.
+#
+# Opens many concurrent connections, each one simulating robot which authenticates and then follows server commands on a grid with obstacles.
+# Robots can halt (recharge) and can send their messages fragmented or pipelined at random byte boundaries.
+# Reports finished sessions per second, latency of server responses, number of moves per session and peak memory of served server.
+#
+# With --suite, starts server for each engine itself and prints results of all of them.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from server import SERVER_KEY, CLIENT_KEY, MESSAGES
+
+DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
+
+## Field shared by all simulated robots
+#
+class Field():
+
+    ## Constructor
+    #
+    #  Generates isolated obstacles (no two obstacles next to each other, none at zero coords), as expected by server specification.
+    #
+    #  @param self
+    #  @param size Field spans from -size to size on both axes
+    #  @param density Probability of cell being obstacle
+    #  @param rng Random generator
+    #
+    def __init__(self, size, density, rng) -> None:
+        self.size = size
+        self.obstacles = set()
+        for x in range(-size, size + 1):
+            for y in range(-size, size + 1):
+                if (x, y) == (0, 0) or rng.random() >= density:
+                    continue
+                if any((x + dx, y + dy) in self.obstacles for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+                    continue
+                self.obstacles.add((x, y))
+
+    ## Choose random start position which is not an obstacle
+    #
+    #  @param self
+    #  @param rng Random generator
+    #
+    #  @returns tuple Coordinates
+    #
+    def start(self, rng) -> tuple:
+        while True:
+            position = (rng.randint(-self.size, self.size), rng.randint(-self.size, self.size))
+            if position not in self.obstacles:
+                return position
+
+
+## Class simulating one robot connected to server
+#
+class Robot():
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param field Field with obstacles
+    #  @param settings Parsed command line arguments
+    #  @param rng Random generator of this robot
+    #  @param results Results collected over all robots
+    #
+    def __init__(self, field, settings, rng, results) -> None:
+        self.field = field
+        self.settings = settings
+        self.rng = rng
+        self.results = results
+        self.position = field.start(rng)
+        self.direction = rng.randrange(4)
+        self.username = "Robot" + str(rng.randrange(100000))
+        self.keyid = rng.randrange(5)
+        self.buffer = b""
+        self.sent = None
+        self.moves = 0
+        self.obstacle_hits = 0
+
+    ## Send messages, optionally split at random byte boundaries
+    #
+    #  @param self
+    #  @param messages Messages without separation characters, all are sent together
+    #
+    async def send(self, *messages):
+        data = b"".join(message.encode("ascii") + b"\a\b" for message in messages)
+        if self.rng.random() < self.settings.fragment:
+            pieces = sorted(self.rng.sample(range(1, len(data)), min(len(data) - 1, self.rng.randint(1, 4))))
+            start = 0
+            for end in pieces + [len(data)]:
+                self.writer.write(data[start:end])
+                await self.writer.drain()
+                start = end
+                if end != len(data):
+                    await asyncio.sleep(self.rng.random() * 0.002)
+        else:
+            self.writer.write(data)
+            await self.writer.drain()
+        self.sent = time.perf_counter()
+
+    ## Receive one message from server and record latency since last sent message
+    #
+    #  @param self
+    #
+    #  @returns str Message without separation characters
+    #
+    async def receive(self) -> str:
+        while b"\a\b" not in self.buffer:
+            data = await asyncio.wait_for(self.reader.read(1024), 10)
+            if not data:
+                raise ConnectionError("Connection closed by server")
+            self.buffer += data
+        (message, _, self.buffer) = self.buffer.partition(b"\a\b")
+        if self.sent is not None:
+            self.results["latencies"].append(time.perf_counter() - self.sent)
+            self.sent = None
+        return message.decode("ascii")
+
+    ## Authenticate, pipelining all three messages with probability given by settings
+    #
+    #  @param self
+    #
+    #  @returns bool Authentication succeeded
+    #
+    async def authenticate(self) -> bool:
+        name_hash = (sum(map(ord, self.username)) * 1000) % 65536
+        confirmation = str((name_hash + CLIENT_KEY[self.keyid]) % 65536)
+
+        if self.rng.random() < self.settings.pipeline:
+            await self.send(self.username, str(self.keyid), confirmation)
+            responses = [await self.receive() for _ in range(3)]
+        else:
+            await self.send(self.username)
+            responses = [await self.receive()]
+            await self.send(str(self.keyid))
+            responses.append(await self.receive())
+            await self.send(confirmation)
+            responses.append(await self.receive())
+
+        expected = ["107 KEY REQUEST", str((name_hash + SERVER_KEY[self.keyid]) % 65536), "200 OK"]
+        return responses == expected
+
+    ## Report position, optionally recharging before (pipelined with position with probability given by settings)
+    #
+    #  @param self
+    #
+    async def report(self):
+        position = "OK " + str(self.position[0]) + " " + str(self.position[1])
+        if self.rng.random() < self.settings.recharge:
+            self.results["recharges"] += 1
+            await self.send("RECHARGING")
+            await asyncio.sleep(self.rng.random() * self.settings.recharge_time)
+            if self.rng.random() < self.settings.pipeline:
+                await self.send("FULL POWER", position)
+                return
+            await self.send("FULL POWER")
+        await self.send(position)
+
+    ## Simulate whole session
+    #
+    #  @param self
+    #
+    #  @returns str Outcome of session
+    #
+    async def run(self) -> str:
+        (self.reader, self.writer) = await asyncio.open_connection(self.settings.host, self.settings.port)
+        try:
+            started = time.perf_counter()
+            if not await self.authenticate():
+                return "login failed"
+            self.results["handshakes"].append(time.perf_counter() - started)
+
+            while True:
+                command = (await self.receive()).encode("ascii") + b"\a\b"
+                if command == MESSAGES["SERVER_MOVE"]:
+                    self.moves += 1
+                    target = (self.position[0] + DIRECTIONS[self.direction][0], self.position[1] + DIRECTIONS[self.direction][1])
+                    if target in self.field.obstacles:
+                        self.obstacle_hits += 1
+                    else:
+                        self.position = target
+                elif command == MESSAGES["SERVER_TURN_LEFT"]:
+                    self.moves += 1
+                    self.direction = (self.direction + 1) % 4
+                elif command == MESSAGES["SERVER_TURN_RIGHT"]:
+                    self.moves += 1
+                    self.direction = (self.direction - 1) % 4
+                elif command == MESSAGES["SERVER_PICK_UP"]:
+                    if self.position != (0, 0):
+                        return "picked up outside of goal"
+                    await self.send("Secret message of robot " + self.username)
+                    if (await self.receive()).encode("ascii") + b"\a\b" != MESSAGES["SERVER_LOGOUT"]:
+                        return "no logout"
+                    return "success"
+                else:
+                    return "unexpected " + command.decode("ascii").strip("\a\b")
+
+                if self.moves > self.settings.move_limit:
+                    return "move limit exceeded"
+                await self.report()
+        finally:
+            self.results["moves"].append(self.moves)
+            self.results["obstacle_hits"].append(self.obstacle_hits)
+            self.writer.close()
+
+
+## Class sampling resident memory of server process and its children (workers)
+#
+class MemorySampler():
+
+    ## Constructor
+    #
+    #  @param self
+    #  @param pid Process id of server or None if unknown
+    #
+    def __init__(self, pid) -> None:
+        self.pid = pid
+        self.peak = None
+
+    ## Sum resident memory of process tree
+    #
+    #  @param self
+    #
+    #  @returns int|None Resident memory in bytes or None if not available
+    #
+    def sample(self):
+        if self.pid is None or not os.path.exists("/proc"):
+            return None
+        total = 0
+        pids = [self.pid]
+        while pids:
+            pid = pids.pop()
+            try:
+                with open("/proc/" + str(pid) + "/status") as status:
+                    for line in status:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+                with open("/proc/" + str(pid) + "/task/" + str(pid) + "/children") as children:
+                    pids += [int(child) for child in children.read().split()]
+            except (OSError, ValueError):
+                continue
+        self.peak = max(self.peak or 0, total)
+        return total
+
+    ## Sample memory periodically until cancelled
+    #
+    #  @param self
+    #
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(0.1)
+
+
+## Compute percentile of sorted values
+#
+#  @param values Sorted list of values
+#  @param percent Percentile (0 - 100)
+#
+#  @returns float|None Value or None if there are no values
+#
+def percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+## Run simulation of all robots against running server
+#
+#  @param settings Parsed command line arguments
+#  @param pid Process id of server (for memory sampling) or None
+#
+#  @returns dict Report
+#
+async def simulate(settings, pid=None) -> dict:
+    rng = random.Random(settings.seed)
+    field = Field(settings.field, settings.obstacles, rng)
+    results = {"latencies": [], "handshakes": [], "moves": [], "obstacle_hits": [], "recharges": 0, "outcomes": {}}
+    sampler = MemorySampler(pid)
+    sampling = asyncio.ensure_future(sampler.run())
+    slots = asyncio.Semaphore(settings.concurrency)
+
+    async def session(index):
+        async with slots:
+            robot = Robot(field, settings, random.Random(rng.random()), results)
+            try:
+                outcome = await robot.run()
+            except (OSError, asyncio.TimeoutError, ConnectionError) as error:
+                outcome = "error " + type(error).__name__
+            results["outcomes"][outcome] = results["outcomes"].get(outcome, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(index) for index in range(settings.robots)))
+    elapsed = time.perf_counter() - started
+    sampling.cancel()
+    sampler.sample()
+
+    latencies = sorted(results["latencies"])
+    handshakes = sorted(results["handshakes"])
+    moves = sorted(results["moves"])
+    return {
+        "robots": settings.robots,
+        "concurrency": settings.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "sessions_per_s": round(settings.robots / elapsed, 2),
+        "outcomes": results["outcomes"],
+        "failure_rate": round(1 - results["outcomes"].get("success", 0) / settings.robots, 4),
+        "latency_ms": {str(p): round(percentile(latencies, p) * 1000, 3) if latencies else None for p in (50, 90, 99, 99.9)},
+        "handshake_ms": {str(p): round(percentile(handshakes, p) * 1000, 3) if handshakes else None for p in (50, 99)},
+        "moves_per_session": {
+            "mean": round(sum(moves) / len(moves), 2) if moves else None,
+            "50": percentile(moves, 50),
+            "95": percentile(moves, 95),
+            "max": moves[-1] if moves else None
+        },
+        "obstacle_hits_per_session": round(sum(results["obstacle_hits"]) / len(moves), 2) if moves else None,
+        "recharges": results["recharges"],
+        "peak_rss_bytes": sampler.peak
+    }
+
+## Find free local port
+#
+#  @returns int Port number
+#
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+## Start server, run simulation against it and stop it
+#
+#  @param settings Parsed command line arguments
+#  @param arguments Additional command line arguments of server
+#
+#  @returns dict Report
+#
+def simulate_spawned(settings, arguments) -> dict:
+    settings.port = free_port()
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server.py")
+    process = subprocess.Popen([sys.executable, server_path, str(settings.port)] + arguments,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Wait for server to listen
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((settings.host, settings.port), 0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        return asyncio.run(simulate(settings, process.pid))
+    finally:
+        process.terminate()
+        process.wait()
+
+## Print report in human readable form
+#
+#  @param name Name of simulated configuration
+#  @param report Report returned by simulate
+#
+def print_report(name, report):
+    print(name)
+    print("  sessions/s        " + str(report["sessions_per_s"]) + " (" + str(report["robots"]) + " robots in " + str(report["elapsed_s"]) + " s)")
+    print("  outcomes          " + ", ".join(key + ": " + str(value) for key, value in sorted(report["outcomes"].items())))
+    print("  latency ms        " + ", ".join("p" + key + " " + str(value) for key, value in report["latency_ms"].items()))
+    print("  handshake ms      " + ", ".join("p" + key + " " + str(value) for key, value in report["handshake_ms"].items()))
+    print("  moves/session     " + ", ".join(key + " " + str(value) for key, value in report["moves_per_session"].items()))
+    print("  obstacle hits     " + str(report["obstacle_hits_per_session"]) + " per session")
+    peak = report["peak_rss_bytes"]
+    print("  peak RSS          " + (str(round(peak / 1048576, 1)) + " MiB" if peak else "unknown"))
+
+## Parse command line arguments
+#
+#  @returns argparse.Namespace Settings
+#
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Simulate robots against BI-PSI server and report performance.")
+    parser.add_argument("port", nargs="?", type=int, help="port of running server (not needed with --suite)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--server-pid", type=int, help="process id of running server, to report its peak memory")
+    parser.add_argument("--suite", action="store_true", help="start server for each engine and compare them")
+    parser.add_argument("--engines", nargs="+", default=["threads", "asyncio", "selectors"], help="engines compared by --suite")
+    parser.add_argument("--server-args", default="--backlog 1024", help="additional arguments of server started by --suite (default: --backlog 1024)")
+    parser.add_argument("--robots", type=int, default=500, help="total number of simulated robots")
+    parser.add_argument("--concurrency", type=int, default=100, help="number of robots connected at the same time")
+    parser.add_argument("--field", type=int, default=15, help="robots start within -field..field on both axes")
+    parser.add_argument("--obstacles", type=float, default=0.08, help="probability of cell being obstacle")
+    parser.add_argument("--recharge", type=float, default=0.02, help="probability of recharging before reporting position")
+    parser.add_argument("--recharge-time", type=float, default=0.5, help="maximum length of recharging in seconds")
+    parser.add_argument("--fragment", type=float, default=0.2, help="probability of message being split at random bytes")
+    parser.add_argument("--pipeline", type=float, default=0.2, help="probability of messages being sent together")
+    parser.add_argument("--move-limit", type=int, default=200, help="robot fails after this many commands")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine readable report")
+    settings = parser.parse_args()
+    if not settings.suite and settings.port is None:
+        parser.error("port is required without --suite")
+    return settings
+
+def main():
+    settings = parse_arguments()
+
+    if settings.suite:
+        reports = {}
+        for engine in settings.engines:
+            reports[engine] = simulate_spawned(settings, ["--engine", engine] + settings.server_args.split())
+    else:
+        reports = {"server": asyncio.run(simulate(settings, settings.server_pid))}
+
+    if settings.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for name, report in reports.items():
+            print_report(name, report)
+
+
+if __name__ == "__main__":
+    main()